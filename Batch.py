@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+
+# Общий модуль лежит рядом со скриптом
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+
+# Скрипты конвертеров и их настройки по умолчанию (для оценки стоимости задач)
+BACKENDS = {
+    "bat": {"script": "To BAT.py", "width": 180, "height": 60, "max_frames": 5000},
+    "mp4": {"script": "To MP4.py", "width": 120, "height": 60, "max_frames": 300},
+}
+
+# Примерная память процесса конвертера без кадров и размер очереди кадров на процесс пула
+BASE_PROCESS_MEMORY = 200 * 1024 * 1024
+FRAMES_IN_FLIGHT_PER_WORKER = 2
+
+def parse_memory(text):
+    """Разбирает объем памяти вида 512M или 8G в байты"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def write_manifest(path, manifest):
+    """Атомарно сохраняет манифест, чтобы прерванный запуск не оставил испорченный файл"""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    os.replace(temporary_path, path)
+
+def job_id(video_path, backend, arguments, output_dir=None):
+    """Идентификатор задачи не меняется между запусками с теми же параметрами"""
+    parts = [os.path.abspath(video_path), backend, arguments]
+    # Одно видео в разные папки - разные задачи; без папки id остается прежним
+    if output_dir:
+        parts.append(os.path.abspath(output_dir))
+    key = json.dumps(parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def parse_job_options(arguments):
+    """Достает из аргументов задачи размеры, влияющие на оценку; при повторе действует последний"""
+    parser = argparse.ArgumentParser(add_help=False)
+    for name in ("width", "height", "max_frames", "output_width", "output_height"):
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int)
+    options, _ = parser.parse_known_args(arguments)
+    return vars(options)
+
+def estimate_job(video_path, backend, options, job_workers):
+    """Оценивает стоимость задачи и пиковую память по числу кадров и разрешению источника"""
+    defaults = BACKENDS[backend]
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+
+    max_frames = options.get("max_frames") or defaults["max_frames"]
+    frames = min(max_frames, total_frames) if total_frames > 0 else max_frames
+    cells = (options.get("width") or defaults["width"]) * (options.get("height") or defaults["height"])
+
+    # Декодирование пропорционально числу пикселей источника, конвертация - числу ячеек
+    frame_bytes = source_width * source_height * 3
+    per_frame = frame_bytes + cells * 16
+    if backend == "mp4":
+        # Отрисовка и кодирование пропорциональны размеру выходного кадра
+        output_bytes = (options.get("output_width") or 1920) * (options.get("output_height") or 1080) * 3
+        per_frame += output_bytes
+        frame_bytes += output_bytes
+
+    # При job_workers > 1 к основному процессу добавляются процессы пула
+    processes = 1 + (job_workers if job_workers > 1 else 0)
+    memory = BASE_PROCESS_MEMORY * processes + frame_bytes * FRAMES_IN_FLIGHT_PER_WORKER * job_workers
+    return {"cost": frames * per_frame, "memory": memory, "frames": frames}
+
+def read_progress(metrics_path):
+    """Возвращает прогресс задачи из последней строки ее файла метрик или None"""
+    try:
+        with open(metrics_path, 'rb') as metrics_file:
+            lines = metrics_file.read().splitlines()
+        snapshot = json.loads(lines[-1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return {name: snapshot.get(name) for name in ("frames_done", "frames_total", "fps", "eta_seconds")}
+
+def build_command(job, job_workers, output_dir, extra_arguments, metrics_path=None):
+    """Собирает командную строку конвертера для одной задачи"""
+    command = [sys.executable, os.path.join(SCRIPT_DIR, BACKENDS[job["backend"]]["script"]), job["input"],
+               "--workers", str(job_workers)]
+    if metrics_path:
+        # Конвертер периодически пишет прогресс и ETA, пакет переносит их в манифест
+        command += ["--metrics", metrics_path, "--metrics-interval", "1"]
+    if output_dir:
+        command += ["--output-dir", output_dir]
+    return command + job["arguments"] + extra_arguments
+
+def run_batch(jobs, manifest_path, cpu_budget, memory_budget, job_workers=1, output_dir=None, extra_arguments=(), poll_interval=0.2):
+    """Выполняет задачи параллельно в пределах бюджета CPU и памяти, ведя манифест состояния"""
+    manifest = {"jobs": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), "batch_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    # Уже выполненные задачи пропускаются, прерванные и упавшие - запускаются снова
+    pending = []
+    for job in jobs:
+        entry = manifest["jobs"].get(job["id"])
+        if entry and entry["status"] == "done":
+            continue
+        manifest["jobs"][job["id"]] = {
+            "input": job["input"],
+            "backend": job["backend"],
+            "status": "pending",
+            "estimated_cost": job["cost"],
+            "estimated_memory": job["memory"],
+            "log": os.path.join(log_dir, f"{job['id']}.log"),
+            "metrics": os.path.join(log_dir, f"{job['id']}.metrics.jsonl"),
+        }
+        pending.append(job)
+    write_manifest(manifest_path, manifest)
+
+    # Сначала самые дорогие задачи: так меньше общее время пакета
+    pending.sort(key=lambda job: job["cost"], reverse=True)
+    print(f"Задач к выполнению: {len(pending)}, уже готово: {len(jobs) - len(pending)}")
+
+    running = {}
+    try:
+        while pending or running:
+            # Запускаем задачи, пока хватает бюджета; одна задача запускается всегда
+            used_cpu = len(running) * job_workers
+            used_memory = sum(job["memory"] for job, _, _ in running.values())
+            for job in list(pending):
+                fits = used_cpu + job_workers <= cpu_budget and used_memory + job["memory"] <= memory_budget
+                if running and not fits:
+                    continue
+
+                entry = manifest["jobs"][job["id"]]
+                log_file = open(entry["log"], 'w', encoding='utf-8')
+                if os.path.exists(entry["metrics"]):
+                    os.remove(entry["metrics"])
+                command = build_command(job, job_workers, output_dir, list(extra_arguments), entry["metrics"])
+                process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+                running[job["id"]] = (job, process, log_file)
+                pending.remove(job)
+
+                entry.update(status="running", started=time.time(), command=command)
+                write_manifest(manifest_path, manifest)
+                print(f"Запущено: {job['input']} ({job['backend']})")
+
+                used_cpu += job_workers
+                used_memory += job["memory"]
+
+            time.sleep(poll_interval)
+
+            for identifier, (job, process, log_file) in list(running.items()):
+                returncode = process.poll()
+                if returncode is None:
+                    # Прогресс и ETA выполняющейся задачи видны в манифесте
+                    entry = manifest["jobs"][identifier]
+                    progress = read_progress(entry["metrics"])
+                    if progress and progress != entry.get("progress"):
+                        entry["progress"] = progress
+                        write_manifest(manifest_path, manifest)
+                    continue
+
+                log_file.close()
+                del running[identifier]
+                entry = manifest["jobs"][identifier]
+                entry.update(status="done" if returncode == 0 else "failed", finished=time.time(), returncode=returncode)
+                entry["progress"] = read_progress(entry["metrics"])
+                entry["seconds"] = entry["finished"] - entry["started"]
+                write_manifest(manifest_path, manifest)
+                print(f"{'Готово' if returncode == 0 else 'Ошибка'}: {job['input']} за {entry['seconds']:.1f} с")
+    except KeyboardInterrupt:
+        # Прерванные задачи отмечаются и будут выполнены при следующем запуске
+        for identifier, (job, process, log_file) in running.items():
+            process.terminate()
+            process.wait()
+            log_file.close()
+            manifest["jobs"][identifier]["status"] = "interrupted"
+        write_manifest(manifest_path, manifest)
+        raise
+
+    statuses = [manifest["jobs"][job["id"]]["status"] for job in jobs]
+    print(f"Пакет завершен: готово {statuses.count('done')}, с ошибками {statuses.count('failed')}")
+    return manifest
+
+def load_jobs(path):
+    """Читает список задач из JSON: [{"input": ..., "backend": ..., "arguments": [...]}]"""
+    with open(path, encoding='utf-8') as jobs_file:
+        return json.load(jobs_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Пакетная конвертация видео в ASCII с ограничением CPU и памяти",
+        epilog="Неизвестные параметры передаются конвертеру без изменений.")
+    parser.add_argument("inputs", nargs="*", help="видео файлы, папки или маски вида *.mp4")
+    parser.add_argument("--jobs", help="JSON со списком задач вместо входных файлов")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mp4", help="конвертер для входных файлов")
+    parser.add_argument("--cpu-budget", type=int, default=os.cpu_count() or 1, help="сколько ядер занимают все задачи вместе")
+    parser.add_argument("--memory-budget", type=parse_memory, default=parse_memory("4G"), help="общий бюджет памяти, например 8G")
+    parser.add_argument("--job-workers", type=int, default=1, help="процессов пула внутри одной задачи")
+    parser.add_argument("--manifest", default="batch_manifest.json", help="файл состояния для продолжения после сбоя")
+    parser.add_argument("--output-dir", help="папка для результатов (по умолчанию рядом с видео)")
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--output-width", type=int)
+    parser.add_argument("--output-height", type=int)
+    args, extra_arguments = parser.parse_known_args(argv)
+
+    if args.jobs:
+        raw_jobs = load_jobs(args.jobs)
+    else:
+        raw_jobs = [{"input": path, "backend": args.backend} for path in Common.find_videos(args.inputs)]
+
+    if not raw_jobs:
+        print("Нет задач для выполнения", file=sys.stderr)
+        return 1
+
+    # Явно заданные размеры передаются конвертеру и учитываются в оценке стоимости
+    options = {name: getattr(args, name) for name in ("width", "height", "max_frames", "output_width", "output_height")}
+    jobs = []
+    for raw_job in raw_jobs:
+        backend = raw_job.get("backend", args.backend)
+        arguments = list(raw_job.get("arguments", []))
+        for name, value in options.items():
+            if value is not None and not (backend == "bat" and name.startswith("output_")):
+                arguments += [f"--{name.replace('_', '-')}", str(value)]
+
+        # Оценка учитывает и собственные аргументы задачи, и заданные в командной строке
+        estimate = estimate_job(raw_job["input"], backend, parse_job_options(arguments), args.job_workers)
+        jobs.append(dict(estimate, input=raw_job["input"], backend=backend, arguments=arguments,
+                         id=job_id(raw_job["input"], backend, arguments + extra_arguments, args.output_dir)))
+
+    manifest = run_batch(jobs, args.manifest, args.cpu_budget, args.memory_budget,
+                         args.job_workers, args.output_dir, extra_arguments)
+    # Манифест может хранить задачи прошлых запусков с другими входами - учитываются только текущие
+    failed = [job for job in jobs if manifest["jobs"][job["id"]]["status"] != "done"]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
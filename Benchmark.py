@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Общий модуль лежит рядом со скриптом
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+
+# Размеры синтетических видео и ASCII сеток по умолчанию
+DEFAULT_RESOLUTIONS = ["640x360", "1280x720", "1920x1080"]
+DEFAULT_GRIDS = ["80x24", "120x60", "240x120"]
+
+def parse_size(text):
+    """Разбирает размер вида 120x60"""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def peak_rss_bytes():
+    """Возвращает пиковое потребление памяти процессом за все время или None, если оно недоступно"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS - в байтах
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+def git_commit():
+    """Возвращает текущий коммит, чтобы результаты можно было сравнивать между коммитами"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def create_synthetic_video(path, width, height, frame_count, fps=30):
+    """Создает тестовое видео: градиент, движущиеся фигуры и шум"""
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    rng = np.random.default_rng(0)
+    gradient = np.zeros((height, width, 3), dtype=np.uint8)
+    gradient[:] = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+
+    for i in range(frame_count):
+        frame = gradient.copy()
+        radius = height // 6
+        center = (int((i * 7) % width), height // 2)
+        cv2.circle(frame, center, radius, (40, 180, 230), -1)
+        cv2.rectangle(frame, (width // 4, height // 8), (width // 4 + radius, height // 8 + radius), (255, 255, 255), -1)
+        noise = rng.integers(0, 24, size=frame.shape, dtype=np.uint8)
+        out.write(cv2.add(frame, noise))
+
+    out.release()
+
+def read_frames(path):
+    """Читает все кадры видео в память, чтобы декодирование не влияло на замеры"""
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def summarize(latencies, extra=None):
+    """Сводит замеры одного этапа: кадры в секунду и процентили задержки"""
+    latencies_ms = np.array(latencies) * 1000
+    total = float(np.sum(latencies))
+    summary = {
+        "frames": len(latencies),
+        "fps": len(latencies) / total if total > 0 else None,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+    summary.update(extra or {})
+    return summary
+
+def time_per_frame(function, items):
+    """Вызывает функцию для каждого элемента и возвращает результаты и время каждого вызова"""
+    results = []
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        results.append(function(item))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+def timed_frames(frames, latencies):
+    """Отдает кадры по одному и записывает время, которое потребитель тратит на каждый кадр"""
+    for frame in frames:
+        start = time.perf_counter()
+        yield frame
+        latencies.append(time.perf_counter() - start)
+
+def benchmark_video(bat, mp4, video_path, grid, output_size, work_dir, encoders=("mp4v",)):
+    """Замеряет все этапы для одного видео и одной ASCII сетки"""
+    width, height = grid
+    frames = read_frames(video_path)
+    results = {}
+
+    # Конвертация кадра в ASCII для BAT (с цветами ANSI) и для MP4 (с RGB цветами)
+    bat_converter = bat.VideoToASCII()
+    bat_frames, latencies = time_per_frame(
+        lambda frame: bat_converter.frame_to_ascii(frame, width, height, use_colors=True, use_random=True), frames)
+    results["bat.frame_to_ascii"] = summarize(latencies)
+
+    mp4_converter = mp4.VideoToASCII()
+    mp4_frames, latencies = time_per_frame(
+        lambda frame: mp4_converter.frame_to_ascii(frame, width, height, use_colors=True, use_random=True), frames)
+    results["mp4.frame_to_ascii"] = summarize(latencies)
+
+    # Подбор символов по форме блока сравнивается с выбором только по яркости
+    shape_converter = mp4.VideoToASCII()
+    shape_converter.engine = "shape"
+    _, latencies = time_per_frame(
+        lambda frame: shape_converter.frame_to_ascii(frame, width, height, use_colors=True, use_random=True), frames)
+    results["mp4.frame_to_ascii[shape]"] = summarize(latencies)
+
+    # Сетка, которая не помещается в кадр MP4, отрисовывается в своем размере, как в To MP4.py без размера кадра
+    grid_size = mp4_converter.get_grid_size(width, height)
+    if grid_size[0] > output_size[0] or grid_size[1] > output_size[1]:
+        print(f"  Сетка {width}x{height} не помещается в кадр {output_size[0]}x{output_size[1]}, "
+              f"кадр MP4 {grid_size[0]}x{grid_size[1]}")
+        output_size = grid_size
+    output_label = f"{output_size[0]}x{output_size[1]}"
+
+    # Отрисовка ASCII кадра в изображение
+    images, latencies = time_per_frame(
+        lambda pair: mp4_converter.ascii_to_image(pair[0], pair[1], *output_size), mp4_frames)
+    results["mp4.ascii_to_image"] = summarize(latencies, {"output_size": output_label})
+
+    # Запись BAT файла и кодирование MP4: задержка - время записи каждого кадра, а FPS считается
+    # по полному времени этапа, в которое входят и сброс буферов после последнего кадра
+    output_path = os.path.join(work_dir, f"bench_{width}x{height}.mp4")
+
+    latencies = []
+    start = time.perf_counter()
+    bat_file, _ = bat_converter.create_bat_file(output_path, timed_frames(bat_frames, latencies), fps=30, frame_count=len(bat_frames))
+    elapsed = time.perf_counter() - start
+    results["bat.create_bat_file"] = summarize(latencies, {
+        "fps": len(latencies) / elapsed,
+        "total_seconds": elapsed,
+        "output_bytes": os.path.getsize(bat_file),
+    })
+
+    # Каждый кодировщик замеряется отдельно; mp4v сохраняет прежнее имя этапа.
+    # Кадр отдается потоку кодирования через очередь, поэтому его задержка - время ожидания места в ней
+    for encoder in encoders:
+        latencies = []
+        start = time.perf_counter()
+        video_file, _ = mp4_converter.create_ascii_video(output_path, timed_frames(images, latencies), 30, *output_size,
+                                                         frame_count=len(images), encoder=encoder)
+        elapsed = time.perf_counter() - start
+        stage = "mp4.create_ascii_video" if encoder == "mp4v" else f"mp4.create_ascii_video[{encoder}]"
+        output_bytes = os.path.getsize(video_file)
+        results[stage] = summarize(latencies, {
+            "fps": len(latencies) / elapsed,
+            "output_size": output_label,
+            "total_seconds": elapsed,
+            "output_bytes": output_bytes,
+            "bitrate_kbps": output_bytes * 8 / (len(images) / 30) / 1000,
+        })
+
+    return results
+
+def compare_results(current, baseline):
+    """Печатает изменение FPS каждого этапа относительно прошлого запуска"""
+    baseline_runs = {(run["video"], run["grid"]): run["stages"] for run in baseline["runs"]}
+    for run in current["runs"]:
+        old_stages = baseline_runs.get((run["video"], run["grid"]))
+        if old_stages is None:
+            continue
+        for stage, summary in run["stages"].items():
+            old = old_stages.get(stage)
+            if old and old.get("fps") and summary.get("fps"):
+                ratio = summary["fps"] / old["fps"]
+                print(f"{run['video']:>12} {run['grid']:>8} {stage:<26} {ratio:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвертации видео в ASCII")
+    parser.add_argument("--resolutions", nargs="+", default=DEFAULT_RESOLUTIONS, help="размеры синтетических видео")
+    parser.add_argument("--grids", nargs="+", default=DEFAULT_GRIDS, help="размеры ASCII сеток")
+    parser.add_argument("--frames", nargs="+", type=int, default=[60], help="длины синтетических видео в кадрах")
+    parser.add_argument("--output-size", default="1920x1080", help="размер кадра MP4")
+    parser.add_argument("--encoders", nargs="+", default=["mp4v"], help="кодировщики MP4: mp4v, libx264, libx265")
+    parser.add_argument("--output", default="benchmark_results.json", help="файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    bat = Common.load_script(os.path.join(SCRIPT_DIR, "To BAT.py"), "to_bat")
+    mp4 = Common.load_script(os.path.join(SCRIPT_DIR, "To MP4.py"), "to_mp4")
+    output_size = parse_size(args.output_size)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for resolution in args.resolutions:
+            for frame_count in args.frames:
+                video_name = f"{resolution}_{frame_count}f"
+                video_path = os.path.join(work_dir, f"{video_name}.mp4")
+                create_synthetic_video(video_path, *parse_size(resolution), frame_count)
+
+                for grid in args.grids:
+                    print(f"Видео {video_name}, сетка {grid}...")
+                    stages = benchmark_video(bat, mp4, video_path, parse_size(grid), output_size, work_dir, args.encoders)
+                    report["runs"].append({"video": video_name, "grid": grid, "stages": stages})
+
+                    for stage, summary in stages.items():
+                        print(f"  {stage:<26} {summary['fps']:9.1f} кадр/с  p95 {summary['latency_p95_ms']:8.2f} мс")
+
+    # Пик памяти известен только для всего процесса, поэтому он один на весь запуск, а не на этап
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    
+    with open(args.output, 'w', encoding='utf-8') as results_file:
+        json.dump(report, results_file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            compare_results(report, json.load(baseline_file))
+
+if __name__ == "__main__":
+    main()
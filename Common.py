@@ -0,0 +1,474 @@
+import glob
+import importlib.util
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Общий код скриптов конвертации. Сами скрипты загружаются по пути (в имени файла есть пробел),
+# а процесс пула, запущенный через spawn, импортирует функции и классы по имени модуля - поэтому они здесь
+
+# Калибровка набора символов по плотности глифов, общая для обоих конвертеров (создается параметром --calibrate)
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charset_calibration.json")
+
+# Конвертер, переданный в процесс пула при его запуске, и общие изображения кадров
+_worker_converter = None
+_worker_canvases = None
+
+def load_script(path, module_name):
+    """Загружает скрипт конвертера по пути как модуль module_name"""
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def worker_initargs(converter, canvases=None):
+    """Аргументы запуска процесса пула: путь и имя модуля скрипта, конвертер в pickle и общие изображения"""
+    converter_class = type(converter)
+    script_path = os.path.abspath(converter_class.__init__.__code__.co_filename)
+    return script_path, converter_class.__module__, pickle.dumps(converter), canvases
+
+def init_worker(script_path, module_name, converter_data, canvases=None):
+    """Инициализирует процесс пула копией настроенного конвертера"""
+    global _worker_converter, _worker_canvases
+    # При spawn новый процесс не знает модуль, под которым скрипт был загружен по пути,
+    # поэтому скрипт загружается заново до восстановления конвертера
+    if module_name not in sys.modules:
+        load_script(script_path, module_name)
+    # Метрики восстанавливаются пустым сборщиком, поэтому и при fork процесс пула
+    # не наследует замеры основного процесса
+    _worker_converter = pickle.loads(converter_data)
+    _worker_canvases = canvases
+
+def convert_in_worker(*args):
+    """Конвертирует кадр в процессе пула; замеры этапов возвращаются вместе с результатом"""
+    result = _worker_converter.convert_frame(*args)
+    return result, _worker_converter.metrics.take()
+
+def take_worker_result(future, metrics):
+    """Возвращает результат процесса пула, добавляя его замеры к метрикам основного процесса"""
+    result, worker_metrics = future.result()
+    metrics.merge(worker_metrics)
+    return result
+
+def render_in_worker(slot, *args):
+    """Конвертирует кадр и рисует его в слот slot общих изображений; изображение не возвращается"""
+    char_indices, colors, _ = _worker_converter.convert_frame(*args, out=_worker_canvases.array[slot])
+    return (char_indices, colors, None), _worker_converter.metrics.take()
+
+class SharedCanvases:
+    """Кольцо изображений кадров в общей памяти между основным процессом и процессами пула"""
+    
+    def __init__(self, slots, shape, name=None):
+        # Без name блок памяти создается, с name - подключается созданный основным процессом
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(self.shape))
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.array = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=self.memory.buf)
+    
+    def __reduce__(self):
+        # В процесс пула передается только имя блока: изображения кадров не копируются через pickle
+        return (type(self), (self.slots, self.shape, self.memory.name))
+    
+    def close(self):
+        """Отключается от блока памяти, а создавший его процесс еще и удаляет блок"""
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+# Расширения, по которым в папках ищутся видео файлы
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".wmv", ".flv", ".webm")
+
+def find_videos(inputs):
+    """Раскрывает пути к файлам, папки и маски вида *.mp4 в список видео файлов"""
+    videos = []
+    for item in inputs:
+        if any(char in item for char in "*?["):
+            videos.extend(sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path)))
+        elif os.path.isdir(item):
+            videos.extend(sorted(
+                os.path.join(item, name) for name in os.listdir(item)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            ))
+        else:
+            videos.append(item)
+    return videos
+
+def get_sample_frames(total_frames, max_frames):
+    """Возвращает номера кадров, равномерно распределенные по всему видео"""
+    # Длина потока неизвестна - читаем кадры подряд до конца или до лимита
+    if total_frames <= 0:
+        return range(max_frames)
+    if total_frames <= max_frames:
+        return range(total_frames)
+    return [i * total_frames // max_frames for i in range(max_frames)]
+
+def iter_video_frames(cap, frame_numbers, metrics, min_seek_gap=8, show_progress=True):
+    """Лениво читает выбранные кадры из видео и отдает пары (номер кадра, кадр); cap закрывается в конце"""
+    # cv2 импортируется здесь: Common.py загружают и скрипты, которым OpenCV не нужен
+    import cv2
+    
+    frames_to_process = len(frame_numbers)
+    processed_frames = 0
+    position = 0  # Номер кадра, который вернет следующий cap.read()
+    
+    # Измеренная стоимость операций в секундах (скользящее среднее)
+    grab_cost = None
+    read_cost = None
+    seek_cost = None
+    can_seek = True
+    
+    try:
+        for target in frame_numbers:
+            gap = target - position
+            seeked = False
+            
+            # Перемотка выгоднее, если пропуск кадров через grab() дольше, чем
+            # set() + декодирование от ближайшего ключевого кадра до нужного
+            if can_seek and gap >= min_seek_gap:
+                skip_cost = gap * (grab_cost or 0) + (read_cost or 0)
+                if seek_cost is None or seek_cost < skip_cost:
+                    start = time.perf_counter()
+                    if cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+                        ret, frame = cap.read()
+                        elapsed = time.perf_counter() - start
+                        seek_cost = _update_average(seek_cost, elapsed)
+                        metrics.add_time("seek", elapsed)
+                        # Перепрыгнутые кадры тоже пропущены, как и захваченные через grab()
+                        metrics.count("frames_skipped", gap)
+                        seeked = True
+                    else:
+                        can_seek = False
+            
+            if not seeked:
+                # Пропущенные кадры только захватываются, без декодирования в изображение
+                if gap > 0:
+                    start = time.perf_counter()
+                    skipped = 0
+                    while skipped < gap and cap.grab():
+                        skipped += 1
+                    elapsed = time.perf_counter() - start
+                    grab_cost = _update_average(grab_cost, elapsed / max(1, skipped))
+                    metrics.add_time("skip", elapsed)
+                    metrics.count("frames_skipped", skipped)
+                
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                elapsed = time.perf_counter() - start
+                read_cost = _update_average(read_cost, elapsed)
+                metrics.add_time("decode", elapsed)
+            
+            if not ret:
+                break
+            position = target + 1
+            processed_frames += 1
+            metrics.count("frames_decoded")
+            
+            if show_progress and processed_frames % 10 == 0:
+                print(f"Обработано кадров: {processed_frames}/{frames_to_process}")
+            
+            yield target, frame
+    finally:
+        cap.release()
+    
+    if show_progress:
+        print(f"Обработка завершена. Создано {processed_frames} ASCII кадров")
+
+def _update_average(average, value):
+    """Обновляет скользящее среднее измеренной стоимости операции"""
+    if average is None:
+        return value
+    return 0.8 * average + 0.2 * value
+
+class CalibrationMixin:
+    """Калибровка набора символов по плотности глифов, общая для конвертеров"""
+    
+    # Класс задает measure_coverage() и calibration_key(), экземпляр - base_chars, ascii_chars и _lut_cache
+    
+    def calibrate_charset(self, path=CALIBRATION_FILE):
+        """Сортирует символы по плотности глифов, строит таблицу яркость -> символ и сохраняет ее"""
+        key = self.calibration_key()
+        self.ascii_chars = self.base_chars
+        coverage = self.measure_coverage()
+        order = np.argsort(coverage, kind='stable')
+        charset = "".join(self.ascii_chars[i] for i in order)
+        coverage = coverage[order]
+        
+        # Яркость 0..255 сопоставляется с плотностью, растянутой на тот же диапазон
+        density = (coverage - coverage[0]) / max(coverage[-1] - coverage[0], 1e-9)
+        targets = np.arange(256) / 255
+        lut = np.abs(density[None, :] - targets[:, None]).argmin(axis=1)
+        # Дробное положение яркости среди символов - для упорядоченного разброса;
+        # символы одинаковой плотности слегка разводятся, чтобы шкала строго возрастала
+        levels = np.interp(targets, density + np.arange(len(density)) * 1e-9, np.arange(len(density)))
+        
+        entry = {
+            "charset": charset,
+            "coverage": np.round(coverage, 5).tolist(),
+            "lut": lut.tolist(),
+            "levels": np.round(levels, 4).tolist(),
+        }
+        
+        # Файл общий для обоих конвертеров, записи различаются ключом
+        calibrations = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as calibration_file:
+                calibrations = json.load(calibration_file)
+        calibrations[key] = entry
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as calibration_file:
+            json.dump(calibrations, calibration_file, ensure_ascii=False, indent=1)
+        os.replace(temporary_path, path)
+        
+        self.apply_calibration(entry)
+        return entry
+    
+    def apply_calibration(self, entry):
+        """Подставляет откалиброванный набор символов и его таблицы"""
+        self.ascii_chars = entry["charset"]
+        # Таблицы кэшируются по набору символов: если его заменят, вернутся обычные формулы
+        lut = np.array(entry["lut"], dtype=np.intp)
+        self._lut_cache[(self.ascii_chars, True)] = lut
+        self._lut_cache[(self.ascii_chars, False)] = lut
+        self._lut_cache[(self.ascii_chars, "levels")] = np.array(entry["levels"], dtype=np.float32)
+    
+    def load_calibration(self, path=CALIBRATION_FILE):
+        """Загружает сохраненную калибровку для текущего набора символов и шрифта"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, encoding='utf-8') as calibration_file:
+                entry = json.load(calibration_file).get(self.calibration_key())
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать калибровку {path}: {e}", file=sys.stderr)
+            return False
+        if entry is None:
+            return False
+        self.apply_calibration(entry)
+        return True
+
+class DitherMixin:
+    """Таблицы символов и разброс индексов, общие для конвертеров"""
+    
+    # Класс задает jitter - наибольший случайный сдвиг индекса в режиме random,
+    # экземпляр - ascii_chars, dither и кэши _lut_cache и _dither_cache
+    
+    def get_char_lut(self, use_random=True):
+        """Возвращает таблицу из 256 индексов символов для каждого значения яркости"""
+        key = (self.ascii_chars, use_random)
+        if key not in self._lut_cache:
+            # Те же формулы, что и в pixel_to_ascii, но посчитанные один раз
+            count = len(self.ascii_chars)
+            if use_random:
+                lut = [min(int(value / 255 * count), count - 1) for value in range(256)]
+            else:
+                lut = [int(value / 255 * (count - 1)) for value in range(256)]
+            self._lut_cache[key] = np.array(lut, dtype=np.intp)
+        return self._lut_cache[key]
+    
+    def get_level_lut(self):
+        """Возвращает таблицу дробного положения яркости среди символов (0..число символов - 1)"""
+        key = (self.ascii_chars, "levels")
+        if key not in self._lut_cache:
+            self._lut_cache[key] = np.arange(256, dtype=np.uint8) * np.float32((len(self.ascii_chars) - 1) / 255)
+        return self._lut_cache[key]
+    
+    def get_dither_thresholds(self, pattern, height, width):
+        """Возвращает пороги 0..1 узора, размноженные на сетку height x width"""
+        key = (pattern, height, width)
+        if key not in self._dither_cache:
+            if pattern == "ordered":
+                # Матрица Байера 8x8 строится из 2x2 удвоением
+                bayer = np.array([[0, 2], [3, 1]])
+                while bayer.shape[0] < 8:
+                    bayer = np.block([[4 * bayer, 4 * bayer + 2], [4 * bayer + 3, 4 * bayer + 1]])
+                tile = (bayer + 0.5) / bayer.size
+            elif pattern == "blue":
+                # Синий шум: белый шум без низких частот, ранги дают равномерное распределение.
+                # Фильтр в частотной области сохраняет периодичность, поэтому плитки стыкуются без швов
+                size = 64
+                noise = np.random.default_rng(0).random((size, size))
+                frequencies = np.hypot(*np.meshgrid(np.fft.fftfreq(size), np.fft.fftfreq(size)))
+                noise = np.real(np.fft.ifft2(np.fft.fft2(noise) * np.clip(frequencies / 0.25, 0, 1)))
+                tile = (np.argsort(np.argsort(noise, axis=None)).reshape(size, size) + 0.5) / noise.size
+            else:
+                raise ValueError(f"Неизвестный узор разброса: {pattern}")
+            
+            repeats = (-(-height // tile.shape[0]), -(-width // tile.shape[1]))
+            self._dither_cache[key] = np.tile(tile, repeats)[:height, :width].astype(np.float32)
+        return self._dither_cache[key]
+    
+    def dither_indices(self, gray_frame, rng=None):
+        """Индексы символов с разбросом по узору self.dither; один seed дает один результат"""
+        count = len(self.ascii_chars)
+        if self.dither == "random":
+            # Смещения всего кадра генерируются одним вызовом
+            char_indices = self.get_char_lut(True)[gray_frame]
+            if rng is None:
+                rng = np.random.default_rng()
+            offsets = rng.integers(-self.jitter, self.jitter + 1, size=char_indices.shape)
+            return np.clip(char_indices + offsets, 0, count - 1)
+        
+        # Упорядоченный разброс: дробная часть уровня яркости сравнивается с порогом ячейки
+        thresholds = self.get_dither_thresholds(self.dither, *gray_frame.shape)
+        levels = self.get_level_lut()[gray_frame]
+        return np.minimum((levels + thresholds).astype(np.intp), count - 1)
+
+class Metrics:
+    """Таймеры этапов, счетчики и прогресс задачи с периодической записью в JSON lines"""
+    
+    enabled = True
+    
+    def __init__(self, path=None, interval=5.0, callback=None):
+        # path - файл для записи снимков метрик, callback(snapshot) - для прогресса и ETA
+        self.path = path
+        self.interval = interval
+        self.callback = callback
+        self.stages = {}
+        self.counters = {}
+        self.job = None
+        self.total_frames = None
+        self.started = time.perf_counter()
+        self._job_started = self.started
+        self._job_done_before = 0
+        self._last_dump = self.started
+        # Этапы могут замеряться из потока кодирования
+        self._lock = threading.Lock()
+    
+    def __reduce__(self):
+        # В процессы пула передается пустой сборщик без файла и callback
+        return (type(self), ())
+    
+    @contextmanager
+    def stage(self, name):
+        """Замеряет время блока кода как этап name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+    
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            stage = self.stages.setdefault(name, [0.0, 0])
+            stage[0] += seconds
+            stage[1] += calls
+    
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def take(self):
+        """Забирает накопленные замеры (в процессе пула - для передачи основному процессу)"""
+        with self._lock:
+            data = {"stages": self.stages, "counters": self.counters}
+            self.stages, self.counters = {}, {}
+        return data
+    
+    def merge(self, data):
+        """Добавляет замеры, полученные из процесса пула"""
+        if not data:
+            return
+        for name, (seconds, calls) in data["stages"].items():
+            self.add_time(name, seconds, calls)
+        for name, value in data["counters"].items():
+            self.count(name, value)
+    
+    def start_job(self, job, total_frames):
+        """Начинает отсчет прогресса и ETA для очередного видео"""
+        self.job = job
+        self.total_frames = total_frames
+        self._job_started = time.perf_counter()
+        self._job_done_before = self.counters.get("frames_written", 0)
+    
+    def frame_done(self):
+        """Отмечает записанный кадр, вызывает callback и при необходимости пишет снимок"""
+        self.count("frames_written")
+        if self.callback is not None:
+            self.callback(self.snapshot())
+        if self.path and time.perf_counter() - self._last_dump >= self.interval:
+            self.dump()
+    
+    def snapshot(self):
+        """Текущее состояние: прогресс, ETA, время этапов и счетчики"""
+        now = time.perf_counter()
+        done = self.counters.get("frames_written", 0) - self._job_done_before
+        elapsed = now - self._job_started
+        fps = done / elapsed if elapsed > 0 else None
+        eta = None
+        if self.total_frames and fps:
+            eta = max(0, self.total_frames - done) / fps
+        
+        with self._lock:
+            stages = {
+                name: {"seconds": seconds, "calls": calls, "ms_per_call": seconds / calls * 1000 if calls else None}
+                for name, (seconds, calls) in self.stages.items()
+            }
+            counters = dict(self.counters)
+        return {
+            "time": time.time(),
+            "elapsed": now - self.started,
+            "job": self.job,
+            "frames_done": done,
+            "frames_total": self.total_frames,
+            "fps": fps,
+            "eta_seconds": eta,
+            "stages": stages,
+            "counters": counters,
+        }
+    
+    def dump(self):
+        """Дописывает снимок метрик строкой JSON"""
+        if not self.path:
+            return
+        with open(self.path, 'a', encoding='utf-8') as metrics_file:
+            metrics_file.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+        self._last_dump = time.perf_counter()
+    
+    def summary(self):
+        """Строка со средним временем этапов на вызов"""
+        with self._lock:
+            parts = [f"{name} {seconds / calls * 1000:.2f} мс" for name, (seconds, calls) in self.stages.items() if calls]
+        return ", ".join(parts)
+
+class NullMetrics:
+    """Выключенные метрики: тот же интерфейс, но без замеров и записи"""
+    
+    enabled = False
+    
+    def stage(self, name):
+        return _NULL_STAGE
+    
+    def add_time(self, name, seconds, calls=1):
+        pass
+    
+    def count(self, name, value=1):
+        pass
+    
+    def take(self):
+        return None
+    
+    def merge(self, data):
+        pass
+    
+    def start_job(self, job, total_frames):
+        pass
+    
+    def frame_done(self):
+        pass
+    
+    def dump(self):
+        pass
+
+# Общий пустой контекст для этапов при выключенных метриках
+_NULL_STAGE = nullcontext()
@@ -0,0 +1,485 @@
+import argparse
+import base64
+import itertools
+import json
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Общий модуль лежит рядом со скриптом
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+
+# Форматы вывода, которые можно получить за один проход конвертации
+OUTPUT_FORMATS = ["mp4", "bat", "ascv", "gif", "webp", "html"]
+
+# Ключевой кадр HTML плеера через столько кадров, чтобы перемотка не требовала всей истории
+HTML_KEYFRAME_INTERVAL = 60
+
+class Sink(threading.Thread):
+    """Получатель общего потока кадров: свой поток и ограниченная очередь"""
+
+    def __init__(self, name, output_path, max_queue=16):
+        super().__init__(daemon=True)
+        self.name = name
+        self.output_path = output_path
+        # Ограниченная очередь дает получателю запас, но не дает отстать без предела
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.finished = False
+        self.written = 0
+        self.busy_seconds = 0.0
+
+    def iter_frames(self):
+        """Отдает кадры (char_indices, colors) из очереди до конца потока"""
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                self.finished = True
+                return
+            yield frame
+            self.written += 1
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.consume(self.iter_frames())
+        except Exception as e:
+            self.error = e
+        finally:
+            # Очередь освобождается до конца потока, даже если получатель упал или прочитал
+            # не все кадры: иначе общий проход зависнет на put
+            while not self.finished:
+                self.finished = self.frames.get() is None
+        self.busy_seconds = time.perf_counter() - start
+
+    def consume(self, frames):
+        raise NotImplementedError
+
+    def put(self, frame):
+        # Упавший получатель не останавливает остальные
+        if self.error is None:
+            self.frames.put(frame)
+
+    def close(self):
+        self.frames.put(None)
+        self.join()
+
+class VideoSink(Sink):
+    """MP4 через create_ascii_video конвертера MP4"""
+
+    def __init__(self, mp4_converter, video_path, fps, output_dir, frame_count, encoder="mp4v", **kwargs):
+        super().__init__("mp4", os.path.join(output_dir, f"{video_name(video_path)}_ascii.mp4"), **kwargs)
+        self.converter = mp4_converter
+        self.video_path = video_path
+        self.fps = fps
+        self.output_dir = output_dir
+        self.frame_count = frame_count
+        self.encoder = encoder
+
+    def consume(self, frames):
+        # Кадр MP4 равен сетке символов, как при --native
+        images = (self.converter.render_frame(char_indices, colors, *self.converter.get_grid_size(*char_indices.shape[::-1]))
+                  for char_indices, colors in frames)
+        first = next(images, None)
+        if first is None:
+            return
+        height, width = first.shape[:2]
+
+        def all_images():
+            yield first
+            yield from images
+
+        self.converter.create_ascii_video(self.video_path, all_images(), self.fps, width, height,
+                                          self.frame_count, self.output_dir, encoder=self.encoder)
+
+class TerminalSink(Sink):
+    """BAT файл или контейнер .ascv через конвертер BAT"""
+
+    def __init__(self, bat_module, charset, video_path, fps, output_dir, frame_count, output_format="bat", **kwargs):
+        extension = "ascv" if output_format == "ascv" else "bat"
+        super().__init__(output_format, os.path.join(output_dir, f"{video_name(video_path)}_ascii.{extension}"), **kwargs)
+        # Индексы символов общие для всех получателей, поэтому BAT использует набор символов MP4
+        self.converter = bat_module.VideoToASCII()
+        self.converter.ascii_chars = charset
+        self.converter.show_progress = False
+        self.video_path = video_path
+        self.fps = fps
+        self.output_dir = output_dir
+        self.frame_count = frame_count
+        self.output_format = output_format
+
+    def to_terminal_indices(self, frames):
+        """Переводит RGB цвета ячеек в номера серых цветов ANSI, как в frame_to_indices BAT"""
+        for char_indices, colors in frames:
+            r, g, b = cv2.split(colors.astype(np.float64))
+            brightness = (0.299 * r + 0.587 * g + 0.114 * b).astype(np.intp)
+            yield char_indices, np.minimum(brightness // 64, len(self.converter.colors) - 1)
+
+    def consume(self, frames):
+        frames = self.to_terminal_indices(frames)
+        if self.output_format == "ascv":
+            first = next(frames, None)
+            if first is None:
+                return
+            height, width = first[0].shape
+
+            def all_frames():
+                yield first
+                yield from frames
+
+            self.converter.create_ascii_container(self.video_path, all_frames(), self.fps, width, height,
+                                                  self.frame_count, output_dir=self.output_dir)
+        else:
+            self.converter.create_bat_file(self.video_path, self.converter.iter_colored_ascii(frames),
+                                           self.fps, self.frame_count, self.output_dir, chunk_frames=500)
+
+class AnimatedImageSink(Sink):
+    """Анимированный GIF или WebP через PIL"""
+
+    def __init__(self, mp4_converter, video_path, fps, output_dir, image_format="gif", scale=0.5, **kwargs):
+        super().__init__(image_format, os.path.join(output_dir, f"{video_name(video_path)}_ascii.{image_format}"), **kwargs)
+        self.converter = mp4_converter
+        self.fps = fps
+        self.image_format = image_format
+        self.scale = scale
+
+    def iter_images(self, frames):
+        from PIL import Image
+
+        for char_indices, colors in frames:
+            height, width = char_indices.shape
+            image = self.converter.render_frame(char_indices, colors, *self.converter.get_grid_size(width, height))
+            if self.scale != 1:
+                image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            # Для GIF палитра строится по каждому кадру: цвета ASCII кадров сильно меняются
+            yield image.quantize(256) if self.image_format == "gif" else image
+
+    def consume(self, frames):
+        images = self.iter_images(frames)
+        first = next(images, None)
+        if first is None:
+            return
+        duration = max(1, round(1000 / self.fps))
+        if self.image_format == "gif":
+            self.write_gif(first, images, duration)
+            return
+
+        # PIL собирает все кадры WebP в список до кодирования, поэтому память растет с длиной
+        # клипа: ширина x высота x 3 байта на кадр. Для длинных видео - GIF или меньший --image-scale
+        first.save(self.output_path, save_all=True, append_images=images, duration=duration, loop=0,
+                   lossless=False, quality=80)
+
+    def write_gif(self, first, images, duration):
+        """Пишет GIF по одному кадру: каждый кадр со своей палитрой, в памяти только текущий"""
+        # save_all держит в памяти все кадры GIF, поэтому файл собирается функциями GifImagePlugin
+        from PIL import GifImagePlugin
+
+        with open(self.output_path, 'wb') as gif_file:
+            header, _ = GifImagePlugin.getheader(first, info={"loop": 0})
+            gif_file.write(b"".join(header))
+            for image in itertools.chain([first], images):
+                gif_file.write(b"".join(GifImagePlugin.getdata(image, duration=duration, include_color_table=True)))
+            gif_file.write(b";")
+
+class HTMLSink(Sink):
+    """Самодостаточная HTML страница с JS плеером и кадрами в виде изменений"""
+
+    def __init__(self, charset, video_path, fps, output_dir, keyframe_interval=HTML_KEYFRAME_INTERVAL, **kwargs):
+        super().__init__("html", os.path.join(output_dir, f"{video_name(video_path)}_ascii.html"), **kwargs)
+        self.charset = charset
+        self.title = video_name(video_path)
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+
+    @staticmethod
+    def pack_cells(char_indices, colors):
+        """Ячейки кадра по 3 байта: символ и цвет RGB 4:4:4 (12 бит)"""
+        # Цвет огрубляется до 4 бит на канал: шум видео не порождает лишних изменений
+        quantized = (colors >> 4).astype(np.uint16)
+        color = (quantized[..., 0] << 8) | (quantized[..., 1] << 4) | quantized[..., 2]
+        cells = np.empty((char_indices.size, 3), dtype=np.uint8)
+        cells[:, 0] = char_indices.ravel()
+        cells[:, 1] = (color & 0xFF).ravel()
+        cells[:, 2] = (color >> 8).ravel()
+        return cells
+
+    def encode_delta(self, cells, previous):
+        """Серии изменившихся ячеек: (пропуск, длина) по 4 байта и данные ячеек серии"""
+        changed = np.any(cells != previous, axis=1)
+        edges = np.diff(np.concatenate([[0], changed.view(np.int8), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        parts = [struct.pack("<I", len(starts))]
+        position = 0
+        for start, end in zip(starts, ends):
+            parts.append(struct.pack("<II", start - position, end - start))
+            parts.append(cells[start:end].tobytes())
+            position = end
+        return b"".join(parts), int(changed.sum())
+
+    def consume(self, frames):
+        data = bytearray()
+        offsets = []
+        keyframes = []
+        previous = None
+        width = height = 0
+        changed_cells = total_cells = 0
+
+        for i, (char_indices, colors) in enumerate(frames):
+            height, width = char_indices.shape
+            cells = self.pack_cells(char_indices, colors)
+            offsets.append(len(data))
+
+            # Ключевые кадры хранятся целиком, остальные - только изменившиеся ячейки
+            if previous is None or i % self.keyframe_interval == 0:
+                keyframes.append(i)
+                data += cells.tobytes()
+            else:
+                delta, changed = self.encode_delta(cells, previous)
+                data += delta
+                changed_cells += changed
+                total_cells += cells.shape[0]
+            previous = cells
+        offsets.append(len(data))
+
+        meta = {
+            "title": self.title,
+            "width": width,
+            "height": height,
+            "fps": self.fps,
+            "charset": self.charset,
+            "offsets": offsets,
+            "keyframes": keyframes,
+        }
+        page = HTML_TEMPLATE.replace("__META__", json.dumps(meta, ensure_ascii=False).replace("</", "<\\/"))
+        page = page.replace("__DATA__", base64.b64encode(bytes(data)).decode("ascii"))
+        page = page.replace("__TITLE__", self.title.replace("&", "&amp;").replace("<", "&lt;"))
+
+        with open(self.output_path, 'w', encoding='utf-8') as html_file:
+            html_file.write(page)
+
+        if total_cells:
+            print(f"HTML: изменилось {changed_cells / total_cells:.1%} ячеек между кадрами, "
+                  f"{len(data) / max(1, len(offsets) - 1) / 1024:.1f} КБ на кадр")
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { margin: 0; background: #000; color: #ccc; font-family: monospace; }
+canvas { display: block; margin: 0 auto; }
+#bar { text-align: center; padding: 4px; }
+</style>
+</head>
+<body>
+<canvas id="screen"></canvas>
+<div id="bar"><button id="toggle">Пауза</button> <span id="info"></span></div>
+<script>
+const meta = __META__;
+const raw = atob("__DATA__");
+const data = new Uint8Array(raw.length);
+for (let i = 0; i < raw.length; i++) data[i] = raw.charCodeAt(i);
+const view = new DataView(data.buffer);
+
+const cellCount = meta.width * meta.height;
+const cells = new Uint8Array(cellCount * 3);
+const fontSize = 12;
+const canvas = document.getElementById("screen");
+const context = canvas.getContext("2d");
+context.font = fontSize + "px monospace";
+const cellWidth = Math.ceil(context.measureText("M").width);
+const cellHeight = fontSize + 2;
+canvas.width = meta.width * cellWidth;
+canvas.height = meta.height * cellHeight;
+const isKeyframe = new Set(meta.keyframes);
+
+function drawCell(index) {
+  const x = (index % meta.width) * cellWidth;
+  const y = Math.floor(index / meta.width) * cellHeight;
+  const color = cells[index * 3 + 1] | (cells[index * 3 + 2] << 8);
+  context.fillStyle = "#000";
+  context.fillRect(x, y, cellWidth, cellHeight);
+  context.fillStyle = "rgb(" + ((color >> 8) & 15) * 17 + "," + ((color >> 4) & 15) * 17 + "," + (color & 15) * 17 + ")";
+  context.fillText(meta.charset[cells[index * 3]], x, y + fontSize);
+}
+
+// Перерисовываются только ячейки, изменившиеся в кадре
+function applyFrame(number) {
+  let position = meta.offsets[number];
+  if (isKeyframe.has(number)) {
+    cells.set(data.subarray(position, position + cellCount * 3));
+    for (let i = 0; i < cellCount; i++) drawCell(i);
+    return;
+  }
+  const runs = view.getUint32(position, true);
+  position += 4;
+  let cell = 0;
+  for (let r = 0; r < runs; r++) {
+    cell += view.getUint32(position, true);
+    const length = view.getUint32(position + 4, true);
+    position += 8;
+    cells.set(data.subarray(position, position + length * 3), cell * 3);
+    for (let i = cell; i < cell + length; i++) drawCell(i);
+    position += length * 3;
+    cell += length;
+  }
+}
+
+// Изменение размера холста сбрасывает шрифт контекста
+context.font = fontSize + "px monospace";
+const frameCount = meta.offsets.length - 1;
+let frame = 0;
+let playing = true;
+let next = performance.now();
+const info = document.getElementById("info");
+
+function tick(now) {
+  if (playing && now >= next && frameCount > 0) {
+    // После последнего кадра воспроизведение начинается с первого ключевого кадра
+    if (frame >= frameCount) frame = 0;
+    applyFrame(frame);
+    info.textContent = meta.title + ": " + (frame + 1) + "/" + frameCount;
+    frame++;
+    next = Math.max(next + 1000 / meta.fps, now);
+  }
+  requestAnimationFrame(tick);
+}
+
+document.getElementById("toggle").onclick = function () {
+  playing = !playing;
+  this.textContent = playing ? "Пауза" : "Играть";
+  next = performance.now();
+};
+requestAnimationFrame(tick);
+</script>
+</body>
+</html>
+"""
+
+def video_name(video_path):
+    return os.path.splitext(os.path.basename(video_path))[0]
+
+def convert_all(video_path, outputs, width=120, height=60, fps=30, max_frames=300, seed=None, output_dir=None,
+                dither="random", encoder="mp4v", image_scale=0.5, max_queue=16, mp4=None, bat=None):
+    """Один проход декодирования и конвертации передает кадры сразу всем выбранным получателям"""
+    mp4 = mp4 or Common.load_script(os.path.join(SCRIPT_DIR, "To MP4.py"), "to_mp4")
+    bat = bat or Common.load_script(os.path.join(SCRIPT_DIR, "To BAT.py"), "to_bat")
+
+    converter = mp4.VideoToASCII()
+    converter.dither = dither
+    # Общий прогресс печатает чтение кадров; получатели пишут только итог, а не строки вперемешку
+    converter.show_progress = False
+
+    print(f"Обработка видео: {video_path}")
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Не удалось открыть видео файл")
+
+    frame_numbers = Common.get_sample_frames(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), max_frames)
+    frame_count = len(frame_numbers)
+
+    if output_dir is None:
+        output_dir = os.path.join(os.path.dirname(video_path), f"{video_name(video_path)}_ascii")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Общий seed делает все форматы одинаковыми по содержанию
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    sinks = []
+    for output_format in outputs:
+        if output_format == "mp4":
+            sinks.append(VideoSink(converter, video_path, fps, output_dir, frame_count, encoder, max_queue=max_queue))
+        elif output_format in ("bat", "ascv"):
+            sinks.append(TerminalSink(bat, converter.ascii_chars, video_path, fps, output_dir, frame_count,
+                                      output_format, max_queue=max_queue))
+        elif output_format in ("gif", "webp"):
+            sinks.append(AnimatedImageSink(converter, video_path, fps, output_dir, output_format, image_scale,
+                                           max_queue=max_queue))
+        elif output_format == "html":
+            sinks.append(HTMLSink(converter.ascii_chars, video_path, fps, output_dir, max_queue=max_queue))
+        else:
+            raise ValueError(f"Неизвестный формат вывода: {output_format}")
+
+    for sink in sinks:
+        sink.start()
+
+    start = time.perf_counter()
+    try:
+        for frame_number, frame in Common.iter_video_frames(cap, frame_numbers, converter.metrics, converter.min_seek_gap, converter.show_progress):
+            rng = np.random.default_rng([seed, frame_number])
+            indices = converter.frame_to_indices(frame, width, height, use_colors=True, use_random=True, rng=rng)
+            # Массивы кадра не изменяются после конвертации, поэтому передаются всем без копирования
+            for sink in sinks:
+                sink.put(indices)
+    finally:
+        for sink in sinks:
+            sink.close()
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for sink in sinks:
+        if sink.error is not None:
+            print(f"Ошибка получателя {sink.name}: {sink.error}", file=sys.stderr)
+            continue
+        results[sink.name] = sink.output_path
+        size = os.path.getsize(sink.output_path) if os.path.exists(sink.output_path) else 0
+        print(f"{sink.name}: {sink.written} кадров, {size / 1024 ** 2:.1f} МБ -> {sink.output_path}")
+    print(f"Общий проход: {frame_count} кадров за {elapsed:.1f} с")
+
+    failed = [sink.name for sink in sinks if sink.error is not None]
+    if failed:
+        raise RuntimeError(f"Не удалось создать: {', '.join(failed)}")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Конвертация видео в несколько ASCII форматов за один проход")
+    parser.add_argument("inputs", nargs="+", help="видео файлы, папки или маски вида *.mp4")
+    parser.add_argument("--outputs", nargs="+", choices=OUTPUT_FORMATS, default=["mp4", "bat", "gif", "html"],
+                        help="форматы вывода")
+    parser.add_argument("--width", type=int, default=120, help="ширина ASCII сетки в символах")
+    parser.add_argument("--height", type=int, default=60, help="высота ASCII сетки в символах")
+    parser.add_argument("--fps", type=float, default=30, help="частота кадров вывода")
+    parser.add_argument("--max-frames", type=int, default=300, help="максимум кадров из одного видео")
+    parser.add_argument("--seed", type=int, help="seed случайных символов для повторяемого результата")
+    parser.add_argument("--dither", choices=["random", "ordered", "blue"], default="random", help="узор разброса символов")
+    parser.add_argument("--encoder", choices=["mp4v", "libx264", "libx265"], default="mp4v", help="кодировщик MP4")
+    parser.add_argument("--image-scale", type=float, default=0.5, help="масштаб кадров GIF/WebP относительно сетки")
+    parser.add_argument("--output-dir", help="папка для результатов (по умолчанию рядом с видео)")
+    args = parser.parse_args(argv)
+
+    mp4 = Common.load_script(os.path.join(SCRIPT_DIR, "To MP4.py"), "to_mp4")
+    bat = Common.load_script(os.path.join(SCRIPT_DIR, "To BAT.py"), "to_bat")
+    videos = Common.find_videos(args.inputs)
+    if not videos:
+        print("Не найдено ни одного видео файла", file=sys.stderr)
+        return 1
+
+    failed = 0
+    for video_path in videos:
+        try:
+            convert_all(video_path, args.outputs, args.width, args.height, args.fps, args.max_frames, args.seed,
+                        args.output_dir, args.dither, args.encoder, args.image_scale, mp4=mp4, bat=bat)
+        except Exception as e:
+            failed += 1
+            print(f"Ошибка при обработке {video_path}: {e}", file=sys.stderr)
+
+    print(f"Обработано видео: {len(videos) - failed}/{len(videos)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
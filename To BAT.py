@@ -1,14 +1,47 @@
 import cv2
 import numpy as np
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import argparse
+import glob
+import json
 import subprocess
 import platform
+import socket
+import sys
+import threading
 import random
 import string
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-class VideoToASCII:
+# Общий модуль лежит рядом со скриптом; процессы пула при spawn получают тот же sys.path
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+from Common import Metrics, NullMetrics
+
+# Сколько секунд ждать поток чтения кадров после остановки: чтение камеры или потока может зависнуть
+GRABBER_JOIN_TIMEOUT = 2.0
+
+# Моноширинные шрифты для замера плотности символов: Windows, Linux, macOS
+FONT_PATHS = (
+    os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts", "consola.ttf"),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/System/Library/Fonts/Monaco.ttf",
+)
+
+# Сигнатура и версия бинарного контейнера ASCII кадров (.ascv)
+CONTAINER_MAGIC = b"ASCV"
+CONTAINER_VERSION = 1
+
+class VideoToASCII(Common.CalibrationMixin, Common.DitherMixin):
+    # Наибольший случайный сдвиг индекса символа в режиме random
+    jitter = 2
+    
     def __init__(self):
         # Расширенный набор ASCII символов для более разнообразного вывода
         self.ascii_chars = string.printable[:-6]  # Исключаем невидимые символы
@@ -23,9 +56,35 @@ class VideoToASCII:
             '\033[97m',  # Белый
         ]
         self.reset_color = '\033[0m'
-    
+
+        # Кэши таблиц для векторизованной конвертации кадров
+        self._lut_cache = {}
+        self._cell_cache = {}
+        
+        # Узор разброса символов: random (свой для каждого кадра), ordered (матрица Байера)
+        # или blue (синий шум); узоры привязаны к ячейкам и не мерцают на неподвижной картинке
+        self.dither = "random"
+        self._dither_cache = {}
+        
+        # Набор символов, отсортированный калибровкой по плотности глифов, если она сохранена;
+        # исходный набор остается ключом калибровки и началом повторной калибровки
+        self.base_chars = self.ascii_chars
+        self.load_calibration()
+        
+        # Метрики этапов; по умолчанию выключены и ничего не стоят
+        self.metrics = NullMetrics()
+        # Печать прогресса записи; To All.py выключает ее, чтобы строки получателей не перемешивались
+        self.show_progress = True
+        
+        # Минимальный пропуск кадров, при котором имеет смысл пробовать перемотку
+        self.min_seek_gap = 8
+
     def get_video_file(self):
         """Открывает диалог выбора видео файла"""
+        # tkinter загружается только для GUI, чтобы скрипт работал на серверах без дисплея
+        import tkinter as tk
+        from tkinter import filedialog
+        
         root = tk.Tk()
         root.withdraw()  # Скрываем главное окно
         
@@ -46,7 +105,7 @@ class VideoToASCII:
             # Используем случайный символ с весом, основанным на яркости
             index = min(int(pixel_value / 255 * len(self.ascii_chars)), len(self.ascii_chars) - 1)
             # Добавляем элемент случайности
-            random_offset = random.randint(-2, 2)
+            random_offset = random.randint(-self.jitter, self.jitter)
             index = max(0, min(len(self.ascii_chars) - 1, index + random_offset))
             return self.ascii_chars[index]
         else:
@@ -71,81 +130,314 @@ class VideoToASCII:
         else:
             return self.colors[3]  # Белый
     
-    def frame_to_ascii(self, frame, width=120, height=30, use_colors=True, use_random=True):
+    def get_cell_table(self, use_colors=True):
+        """Возвращает таблицу готовых строк ячеек: (цвет + символ) для начала серии и просто символы"""
+        key = (self.ascii_chars, tuple(self.colors), use_colors)
+        if key not in self._cell_cache:
+            cells = list(self.ascii_chars)
+            if use_colors:
+                cells = [color + char for color in self.colors for char in self.ascii_chars] + cells
+            self._cell_cache[key] = np.array(cells, dtype=object)
+        return self._cell_cache[key]
+    
+    def get_run_starts(self, color_indices):
+        """Отмечает ячейки, с которых начинается серия одного цвета в строке"""
+        run_starts = np.ones(color_indices.shape, dtype=bool)
+        run_starts[:, 1:] = color_indices[:, 1:] != color_indices[:, :-1]
+        return run_starts
+    
+    def count_saved_bytes(self, color_indices):
+        """Считает, сколько байт экономит вывод цвета сериями по сравнению с кодом на каждую ячейку"""
+        code_sizes = np.array([len(color.encode('utf-8')) for color in self.colors])
+        reset_size = len(self.reset_color.encode('utf-8'))
+        
+        per_cell = code_sizes[color_indices].sum() + color_indices.size * reset_size
+        per_run = code_sizes[color_indices[self.get_run_starts(color_indices)]].sum() + color_indices.shape[0] * reset_size
+        return int(per_cell - per_run)
+
+    def calibration_key(self):
+        """Ключ калибровки: исходный набор символов, шрифт замера и способ вывода"""
+        return f"terminal|{find_font_path() or 'default'}|{self.base_chars}"
+    
+    def measure_coverage(self):
+        """Растеризует символы моноширинным шрифтом и возвращает долю закрашенных пикселей каждого"""
+        # PIL нужен только для калибровки, поэтому загружается здесь
+        from PIL import Image, ImageDraw, ImageFont
+        
+        font_path = find_font_path()
+        font = ImageFont.truetype(font_path, 32) if font_path else ImageFont.load_default()
+        
+        # Ячейка терминала: ширина символа на высоту строки
+        ascent, descent = font.getmetrics()
+        cell_size = (max(1, round(font.getlength("M"))), ascent + descent)
+        coverage = []
+        for char in self.ascii_chars:
+            mask = Image.new('L', cell_size, color=0)
+            ImageDraw.Draw(mask).text((0, 0), char, fill=255, font=font)
+            coverage.append(np.asarray(mask).mean() / 255)
+        return np.array(coverage)
+    
+    def frame_to_indices(self, frame, width=120, height=30, use_random=True, rng=None):
+        """Конвертирует кадр в массивы индексов символов и индексов цветов"""
+        with self.metrics.stage("resize"):
+            # Изменяем размер кадра
+            frame_resized = cv2.resize(frame, (width, height))
+
+            # Конвертируем в оттенки серого для определения яркости
+            gray_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
+
+        with self.metrics.stage("map"):
+            # Один проход по таблице вместо вызова pixel_to_ascii для каждой ячейки
+            if use_random:
+                char_indices = self.dither_indices(gray_frame, rng)
+            else:
+                char_indices = self.get_char_lut(False)[gray_frame]
+
+            # Яркость и номер цвета считаются так же, как в get_color_from_pixel
+            b, g, r = cv2.split(frame_resized.astype(np.float64))
+            brightness = (0.299 * r + 0.587 * g + 0.114 * b).astype(np.intp)
+            color_indices = np.minimum(brightness // 64, len(self.colors) - 1)
+
+        return char_indices, color_indices
+
+    def indices_to_ascii(self, char_indices, color_indices=None):
+        """Собирает строки кадра из массивов индексов"""
+        if color_indices is None:
+            cells = self.get_cell_table(use_colors=False)[char_indices]
+            return ["".join(row) for row in cells]
+        
+        # Код цвета выводится только в начале серии одинаковых цветов,
+        # остальные ячейки серии ссылаются на символ без кода
+        plain_offset = len(self.colors) * len(self.ascii_chars)
+        cell_indices = np.where(
+            self.get_run_starts(color_indices),
+            color_indices * len(self.ascii_chars) + char_indices,
+            plain_offset + char_indices,
+        )
+        cells = self.get_cell_table(use_colors=True)[cell_indices]
+        
+        # Сброс цвета - один раз в конце строки
+        return ["".join(row) + self.reset_color for row in cells]
+
+    def frame_to_ascii(self, frame, width=120, height=30, use_colors=True, use_random=True, rng=None):
         """Конвертирует кадр в ASCII с цветами"""
-        # Изменяем размер кадра
-        frame_resized = cv2.resize(frame, (width, height))
-        
-        # Конвертируем в оттенки серого для определения яркости
-        gray_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
-        
-        ascii_frame = []
-        for y in range(height):
-            row = ""
-            for x in range(width):
-                pixel_value = gray_frame[y, x]
-                ascii_char = self.pixel_to_ascii(pixel_value, use_random)
-                
-                if use_colors:
-                    color = self.get_color_from_pixel(frame_resized[y, x])
-                    row += color + ascii_char + self.reset_color
-                else:
-                    row += ascii_char
-            
-            ascii_frame.append(row)
+        char_indices, color_indices = self.frame_to_indices(frame, width, height, use_random, rng)
+
+        if use_colors:
+            return self.indices_to_ascii(char_indices, color_indices)
+        return self.indices_to_ascii(char_indices)
+    
+    def write_bat_header(self, bat_file, video_name):
+        """Пишет начало BAT файла: кодировка, заголовок окна и поддержка цветов"""
+        bat_file.write("@echo off\n")
+        bat_file.write("chcp 65001 >nul\n")  # Устанавливаем UTF-8 кодировку
+        bat_file.write("cls\n")
+        bat_file.write("title ASCII Video Player - " + video_name + "\n")
+        bat_file.write("mode con cols=150 lines=40\n")  # Устанавливаем размер окна
+        
+        # Включаем поддержку ANSI цветов в Windows
+        bat_file.write("reg add HKCU\\Console /v VirtualTerminalLevel /t REG_DWORD /d 1 /f >nul 2>&1\n")
+    
+    def format_bat_frame(self, frame, number, frame_count, video_name, delay):
+        """Возвращает команды BAT для показа одного кадра одной строкой"""
+        parts = ["cls\n", f"echo Frame {number}/{frame_count}: {video_name}\n", "echo.\n"]
+        
+        for line in frame:
+            # Экранируем специальные символы для BAT
+            escaped_line = line.replace("&", "^&").replace("<", "^<").replace(">", "^>").replace("|", "^|")
+            parts.append(f"echo {escaped_line}\n")
         
-        return ascii_frame
+        parts.append("echo.\n")
+        parts.append("echo Нажмите Ctrl+C для выхода\n")
+        
+        # Добавляем задержку
+        if delay > 0:
+            parts.append(f"timeout /t 0 /nobreak >nul\n")
+            parts.append(f"ping localhost -n 1 -w {delay} >nul\n")
+        
+        return "".join(parts)
     
-    def create_bat_file(self, video_path, frames_ascii, fps=10):
+    def create_bat_file(self, video_path, frames_ascii, fps=10, frame_count=None, output_dir=None, chunk_frames=None):
         """Создает BAT файл для воспроизведения ASCII анимации"""
+        # frames_ascii может быть генератором: кадры пишутся по мере поступления
+        if frame_count is None:
+            frame_count = len(frames_ascii)
+
         video_name = os.path.splitext(os.path.basename(video_path))[0]
-        output_dir = os.path.join(os.path.dirname(video_path), f"{video_name}_ascii")
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(video_path), f"{video_name}_ascii")
         
         # Создаем папку для вывода
         os.makedirs(output_dir, exist_ok=True)
         
         bat_filename = os.path.join(output_dir, f"{video_name}_ascii.bat")
+        delay = max(1, int(1000 / fps))  # Задержка в миллисекундах
+        
+        # Длинное видео делится на части: cmd.exe разбирает BAT файл последовательно,
+        # и один огромный файл долго запускается и сбивает темп воспроизведения
+        chunk_dir = os.path.join(output_dir, f"{video_name}_chunks")
+        chunked = bool(chunk_frames) and frame_count > chunk_frames
+        if chunked:
+            os.makedirs(chunk_dir, exist_ok=True)
+            for old_chunk in glob.glob(os.path.join(chunk_dir, "chunk_*.bat")):
+                os.remove(old_chunk)
+        
+        writer = BufferedBlockWriter(self.metrics)
+        chunk_names = []
         
-        with open(bat_filename, 'w', encoding='utf-8') as bat_file:
-            # Заголовок BAT файла
-            bat_file.write("@echo off\n")
-            bat_file.write("chcp 65001 >nul\n")  # Устанавливаем UTF-8 кодировку
-            bat_file.write("cls\n")
-            bat_file.write("title ASCII Video Player - " + video_name + "\n")
-            bat_file.write("mode con cols=150 lines=40\n")  # Устанавливаем размер окна
+        with open(bat_filename, 'w', encoding='utf-8', buffering=BufferedBlockWriter.BLOCK_SIZE) as bat_file:
+            self.write_bat_header(bat_file, video_name)
             
-            # Включаем поддержку ANSI цветов в Windows
-            bat_file.write("reg add HKCU\\Console /v VirtualTerminalLevel /t REG_DWORD /d 1 /f >nul 2>&1\n")
+            # Сколько кадров записано, известно только в конце: число задается там же, в блоке :init,
+            # а кадры выводят его переменной (видео может закончиться раньше, чем обещал frame_count)
+            bat_file.write("goto init\n")
             
             # Основной цикл воспроизведения
             bat_file.write(":loop\n")
             
-            delay = max(1, int(1000 / fps))  # Задержка в миллисекундах
+            chunk_file = None
+            written_frames = 0
+            try:
+                for i, frame in enumerate(frames_ascii):
+                    target = bat_file
+                    if chunked:
+                        if i % chunk_frames == 0:
+                            if chunk_file is not None:
+                                writer.close(chunk_file)
+                            chunk_names.append(f"chunk_{len(chunk_names):04d}.bat")
+                            chunk_file = open(os.path.join(chunk_dir, chunk_names[-1]), 'w', encoding='utf-8',
+                                              buffering=BufferedBlockWriter.BLOCK_SIZE)
+                        target = chunk_file
+                    
+                    writer.write(target, self.format_bat_frame(frame, i + 1, "%FRAME_COUNT%", video_name, delay))
+                    written_frames = i + 1
+                    self.metrics.frame_done()
+            finally:
+                if chunk_file is not None:
+                    writer.close(chunk_file)
             
-            for i, frame in enumerate(frames_ascii):
-                bat_file.write("cls\n")
-                bat_file.write(f"echo Frame {i+1}/{len(frames_ascii)}: {video_name}\n")
-                bat_file.write("echo.\n")
+            # Главный файл только вызывает части по очереди; каждая читается, когда до нее дошла очередь
+            for chunk_name in chunk_names:
+                writer.write(bat_file, f'call "%~dp0{video_name}_chunks\\{chunk_name}"\n')
+            
+            writer.write(bat_file, "goto loop\npause\n")
+            writer.write(bat_file, f":init\nset FRAME_COUNT={written_frames}\ngoto loop\n")
+            writer.close(bat_file)
+        
+        total_bytes = os.path.getsize(bat_filename)
+        total_bytes += sum(os.path.getsize(os.path.join(chunk_dir, chunk_name)) for chunk_name in chunk_names)
+        self.metrics.count("bytes_out", total_bytes)
+        
+        if writer.seconds > 0:
+            parts = f", частей: {len(chunk_names)}" if chunk_names else ""
+            print(f"Запись BAT: {total_bytes / 1024 ** 2:.1f} МБ за {writer.seconds:.2f} с "
+                  f"({total_bytes / 1024 ** 2 / writer.seconds:.0f} МБ/с){parts}")
+        
+        return bat_filename, output_dir
+    
+    def create_ascii_container(self, video_path, frames, fps=10, width=120, height=30, frame_count=None, keyframe_interval=30, output_dir=None):
+        """Создает компактный бинарный контейнер .ascv с массивами индексов кадров"""
+        # frames - пары (char_indices, color_indices), может быть генератором
+        if frame_count is None:
+            frame_count = len(frames)
+        
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(video_path), f"{video_name}_ascii")
+        
+        # Создаем папку для вывода
+        os.makedirs(output_dir, exist_ok=True)
+        
+        container_filename = os.path.join(output_dir, f"{video_name}_ascii.ascv")
+        char_dtype = np.dtype(np.uint8) if len(self.ascii_chars) <= 256 else np.dtype('<u2')
+        
+        with open(container_filename, 'wb') as container:
+            # Заголовок: размеры, FPS, набор символов и цвета для восстановления текста
+            container.write(CONTAINER_MAGIC)
+            container.write(struct.pack("<BHHfH", CONTAINER_VERSION, width, height, fps, keyframe_interval))
+            charset = self.ascii_chars.encode('utf-8')
+            container.write(struct.pack("<I", len(charset)) + charset)
+            container.write(struct.pack("<B", len(self.colors)))
+            for code in self.colors + [self.reset_color]:
+                code = code.encode('utf-8')
+                container.write(struct.pack("<B", len(code)) + code)
+            
+            index = []
+            previous = None
+            
+            for i, (char_indices, color_indices) in enumerate(frames):
+                start = time.perf_counter()
+                current = np.concatenate([
+                    char_indices.astype(char_dtype).view(np.uint8).ravel(),
+                    color_indices.astype(np.uint8).ravel(),
+                ])
                 
-                for line in frame:
-                    # Экранируем специальные символы для BAT
-                    escaped_line = line.replace("&", "^&").replace("<", "^<").replace(">", "^>").replace("|", "^|")
-                    bat_file.write(f"echo {escaped_line}\n")
+                # Ключевые кадры хранятся целиком, остальные - как XOR с предыдущим:
+                # неизменившиеся ячейки дают нули и почти не занимают места
+                is_keyframe = previous is None or i % keyframe_interval == 0
+                payload = current if is_keyframe else np.bitwise_xor(current, previous)
+                data = zlib.compress(payload.tobytes(), 6)
                 
-                bat_file.write("echo.\n")
-                bat_file.write("echo Нажмите Ctrl+C для выхода\n")
+                index.append((container.tell(), len(data), is_keyframe))
+                container.write(data)
+                previous = current
+                self.metrics.add_time("write", time.perf_counter() - start)
+                self.metrics.frame_done()
                 
-                # Добавляем задержку
-                if delay > 0:
-                    bat_file.write(f"timeout /t 0 /nobreak >nul\n")
-                    bat_file.write(f"ping localhost -n 1 -w {delay} >nul\n")
+                if self.show_progress and (i + 1) % 10 == 0:
+                    print(f"Записано кадров: {i + 1}/{frame_count}")
             
-            bat_file.write("goto loop\n")
-            bat_file.write("pause\n")
+            # Индекс кадров в конце файла позволяет перематывать воспроизведение
+            index_offset = container.tell()
+            for offset, size, is_keyframe in index:
+                container.write(struct.pack("<QIB", offset, size, is_keyframe))
+            container.write(struct.pack("<QI", index_offset, len(index)) + CONTAINER_MAGIC)
         
-        return bat_filename, output_dir
+        self.metrics.count("bytes_out", os.path.getsize(container_filename))
+        return container_filename, output_dir
+    
+    def convert_frame(self, frame_number, frame, width, height, seed):
+        """Конвертирует один кадр в индексы; случайность зависит только от seed и номера кадра"""
+        rng = np.random.default_rng([seed, frame_number])
+        indices = self.frame_to_indices(frame, width, height, use_random=True, rng=rng)
+        self.metrics.count("frames_converted")
+        return indices
+    
+    def iter_frame_indices(self, frames, width, height, seed, workers=1):
+        """Конвертирует поток кадров в индексы символов и цветов, при workers > 1 - в пуле процессов"""
+        if workers <= 1:
+            for frame_number, frame in frames:
+                yield self.convert_frame(frame_number, frame, width, height, seed)
+            return
+        
+        with ProcessPoolExecutor(workers, initializer=Common.init_worker, initargs=Common.worker_initargs(self)) as pool:
+            # Очередь задач в порядке кадров служит буфером переупорядочивания:
+            # результат отдается только когда готов самый ранний кадр
+            pending = deque()
+            for frame_number, frame in frames:
+                pending.append(pool.submit(Common.convert_in_worker, frame_number, frame, width, height, seed))
+                if len(pending) >= workers * 2:
+                    yield Common.take_worker_result(pending.popleft(), self.metrics)
+            
+            while pending:
+                yield Common.take_worker_result(pending.popleft(), self.metrics)
     
-    def process_video(self, video_path, max_frames=300, width=120, height=30, fps=10):
+    def iter_colored_ascii(self, frames):
+        """Собирает цветной текст кадров и сообщает, сколько байт сэкономил вывод цвета сериями"""
+        saved_bytes = 0
+        frame_count = 0
+        
+        for char_indices, color_indices in frames:
+            with self.metrics.stage("format"):
+                saved_bytes += self.count_saved_bytes(color_indices)
+                lines = self.indices_to_ascii(char_indices, color_indices)
+            frame_count += 1
+            yield lines
+        
+        if frame_count:
+            print(f"Цвета ANSI сериями: сэкономлено {saved_bytes} байт, {saved_bytes // frame_count} байт на кадр")
+    
+    def process_video(self, video_path, max_frames=300, width=120, height=30, fps=10, workers=1, seed=None, output_format="bat", output_dir=None, chunk_frames=500):
         """Обрабатывает видео и конвертирует в ASCII"""
         print(f"Обработка видео: {video_path}")
         
@@ -160,35 +452,32 @@ class VideoToASCII:
         print(f"Оригинальный FPS: {original_fps}")
         
         # Ограничиваем количество кадров для производительности
-        frames_to_process = min(max_frames, total_frames)
-        frame_step = max(1, total_frames // frames_to_process)
+        frame_numbers = Common.get_sample_frames(total_frames, max_frames)
+        frames_to_process = len(frame_numbers)
+        self.metrics.start_job(video_path, frames_to_process)
         
-        frames_ascii = []
-        frame_count = 0
-        processed_frames = 0
+        # Общий seed делает результат одинаковым при любом числе процессов
+        if seed is None:
+            seed = random.randrange(2 ** 32)
         
-        while cap.isOpened() and processed_frames < frames_to_process:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count % frame_step == 0:
-                ascii_frame = self.frame_to_ascii(frame, width, height, use_colors=True, use_random=True)
-                frames_ascii.append(ascii_frame)
-                processed_frames += 1
-                
-                if processed_frames % 10 == 0:
-                    print(f"Обработано кадров: {processed_frames}/{frames_to_process}")
-            
-            frame_count += 1
+        # Кадры читаются, конвертируются и записываются по одному
+        frames = Common.iter_video_frames(cap, frame_numbers, self.metrics, self.min_seek_gap, self.show_progress)
+        frames = self.iter_frame_indices(frames, width, height, seed, workers)
         
-        cap.release()
-        print(f"Обработка завершена. Создано {len(frames_ascii)} ASCII кадров")
+        if output_format == "ascv":
+            # Создаем бинарный контейнер
+            output_file, output_dir = self.create_ascii_container(
+                video_path, frames, fps, width, height, frames_to_process, output_dir=output_dir)
+        else:
+            # Создаем BAT файл
+            frames_ascii = self.iter_colored_ascii(frames)
+            output_file, output_dir = self.create_bat_file(video_path, frames_ascii, fps, frames_to_process, output_dir, chunk_frames)
         
-        # Создаем BAT файл
-        bat_file, output_dir = self.create_bat_file(video_path, frames_ascii, fps)
+        if self.metrics.enabled:
+            print(f"Этапы: {self.metrics.summary()}")
+            self.metrics.dump()
         
-        return bat_file, output_dir
+        return output_file, output_dir
     
     def open_folder(self, folder_path):
         """Открывает папку в файловом менеджере"""
@@ -202,7 +491,429 @@ class VideoToASCII:
         except Exception as e:
             print(f"Не удалось открыть папку: {e}")
 
-def main():
+class ASCIIContainer:
+    """Чтение бинарного контейнера .ascv, созданного create_ascii_container"""
+    
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self._read_header()
+        except Exception:
+            # Файл закрывается, если заголовок или индекс не удалось прочитать
+            self.file.close()
+            raise
+        
+        # Последний декодированный кадр для быстрого последовательного чтения
+        self._current_number = None
+        self._current = None
+    
+    def _read_header(self):
+        """Читает заголовок с набором символов и цветов и индекс кадров"""
+        if self.file.read(4) != CONTAINER_MAGIC:
+            raise ValueError("Файл не является контейнером ASCII кадров")
+        version, self.width, self.height, self.fps, self.keyframe_interval = struct.unpack("<BHHfH", self.file.read(11))
+        if version != CONTAINER_VERSION:
+            raise ValueError(f"Неподдерживаемая версия контейнера: {version}")
+        
+        # Конвертер с набором символов и цветов из контейнера собирает текст кадров
+        self.converter = VideoToASCII()
+        charset_size, = struct.unpack("<I", self.file.read(4))
+        self.converter.ascii_chars = self.file.read(charset_size).decode('utf-8')
+        colors_count, = struct.unpack("<B", self.file.read(1))
+        codes = []
+        for _ in range(colors_count + 1):
+            code_size, = struct.unpack("<B", self.file.read(1))
+            codes.append(self.file.read(code_size).decode('utf-8'))
+        self.converter.colors = codes[:-1]
+        self.converter.reset_color = codes[-1]
+        self.char_dtype = np.dtype(np.uint8) if len(self.converter.ascii_chars) <= 256 else np.dtype('<u2')
+        
+        # Индекс кадров находится в конце файла
+        self.file.seek(-16, os.SEEK_END)
+        index_offset, frame_count = struct.unpack("<QI", self.file.read(12))
+        self.file.seek(index_offset)
+        self.index = [struct.unpack("<QIB", self.file.read(13)) for _ in range(frame_count)]
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read_indices(i)
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def _read_payload(self, frame_number):
+        """Читает и распаковывает данные одного кадра"""
+        offset, size, _ = self.index[frame_number]
+        self.file.seek(offset)
+        return np.frombuffer(zlib.decompress(self.file.read(size)), dtype=np.uint8)
+    
+    def read_indices(self, frame_number):
+        """Возвращает массивы (char_indices, color_indices) кадра с любым номером"""
+        keyframe = frame_number
+        while not self.index[keyframe][2]:
+            keyframe -= 1
+        
+        # Продолжаем от текущего кадра, если он между ключевым и нужным, иначе - от ключевого
+        if self._current_number is not None and keyframe <= self._current_number <= frame_number:
+            start = self._current_number + 1
+        else:
+            start = keyframe
+        
+        for number in range(start, frame_number + 1):
+            payload = self._read_payload(number)
+            self._current = payload if self.index[number][2] else np.bitwise_xor(self._current, payload)
+            self._current_number = number
+        
+        cells = self.width * self.height
+        char_bytes = cells * self.char_dtype.itemsize
+        char_indices = self._current[:char_bytes].view(self.char_dtype).reshape(self.height, self.width)
+        color_indices = self._current[char_bytes:].reshape(self.height, self.width)
+        return char_indices.astype(np.intp), color_indices.astype(np.intp)
+    
+    def read_ascii(self, frame_number, use_colors=True):
+        """Восстанавливает текстовое представление кадра, как в BAT файле"""
+        char_indices, color_indices = self.read_indices(frame_number)
+        return self.converter.indices_to_ascii(char_indices, color_indices if use_colors else None)
+
+class TerminalPlayer:
+    """Воспроизведение ASCII кадров в терминале с перерисовкой только изменившихся ячеек"""
+    
+    def __init__(self, converter, out=None, fps=10, clock=time.monotonic, sleep=time.sleep):
+        # converter задает набор символов и цвета, out - терминал или любой файл
+        self.converter = converter
+        self.out = out if out is not None else sys.stdout
+        self.fps = fps
+        self.clock = clock
+        self.sleep = sleep
+        
+        # Максимальный промежуток без изменений, который перерисовывается вместо перехода курсора
+        self.max_gap = 4
+        
+        # То, что сейчас показано на экране
+        self.screen_chars = None
+        self.screen_colors = None
+    
+    def render_diff(self, char_indices, color_indices):
+        """Возвращает escape-последовательности, переводящие экран в новый кадр"""
+        converter = self.converter
+        
+        if self.screen_chars is None or self.screen_chars.shape != char_indices.shape:
+            # Первый кадр рисуется целиком: строки с позиционированием курсора
+            lines = converter.indices_to_ascii(char_indices, color_indices)
+            output = "\033[2J" + "".join(f"\033[{y + 1};1H{line}" for y, line in enumerate(lines))
+        else:
+            changed = (char_indices != self.screen_chars) | (color_indices != self.screen_colors)
+            
+            # Короткие промежутки между изменениями дешевле перерисовать, чем перепрыгнуть курсором
+            before = np.zeros_like(changed)
+            after = np.zeros_like(changed)
+            for shift in range(1, self.max_gap + 1):
+                before[:, shift:] |= changed[:, :-shift]
+                after[:, :-shift] |= changed[:, shift:]
+            changed |= before & after
+            
+            ys, xs = np.nonzero(changed)
+            if len(ys) == 0:
+                output = ""
+            else:
+                chars = char_indices[ys, xs]
+                colors = color_indices[ys, xs]
+                
+                # Серия - подряд идущие изменившиеся ячейки одной строки; перед ней
+                # ставится курсор, а код цвета - в начале серии и при смене цвета
+                run_starts = np.ones(len(ys), dtype=bool)
+                run_starts[1:] = (ys[1:] != ys[:-1]) | (xs[1:] != xs[:-1] + 1)
+                color_starts = run_starts.copy()
+                color_starts[1:] |= colors[1:] != colors[:-1]
+                
+                plain_offset = len(converter.colors) * len(converter.ascii_chars)
+                cell_indices = np.where(color_starts, colors * len(converter.ascii_chars) + chars, plain_offset + chars)
+                cells = converter.get_cell_table(use_colors=True)[cell_indices]
+                
+                cursors = np.array([f"\033[{y + 1};{x + 1}H" for y, x in zip(ys[run_starts], xs[run_starts])], dtype=object)
+                cells[run_starts] = cursors + cells[run_starts]
+                output = "".join(cells) + converter.reset_color
+                
+                # При большом числе изменений полная перерисовка строк бывает короче
+                if len(ys) > changed.size // 4:
+                    lines = converter.indices_to_ascii(char_indices, color_indices)
+                    full = "".join(f"\033[{y + 1};1H{line}" for y, line in enumerate(lines))
+                    if len(full) < len(output):
+                        output = full
+        
+        self.screen_chars = char_indices.copy()
+        self.screen_colors = color_indices.copy()
+        return output
+    
+    def play(self, frames, frame_count=None):
+        """Воспроизводит кадры (char_indices, color_indices) с заданным FPS, пропуская опоздавшие"""
+        frame_time = 1 / self.fps
+        shown_frames = 0
+        dropped_frames = 0
+        written_bytes = 0
+        
+        self.out.write("\033[?25l")  # Скрываем курсор
+        start = self.clock()
+        
+        try:
+            for i, (char_indices, color_indices) in enumerate(frames):
+                # Время показа кадра отсчитывается от начала, поэтому ошибки не накапливаются
+                deadline = start + i * frame_time
+                delay = deadline - self.clock()
+                
+                # Опоздавший больше чем на кадр пропускается, если это не последний кадр
+                if delay < -frame_time and (frame_count is None or i < frame_count - 1):
+                    dropped_frames += 1
+                    continue
+                if delay > 0:
+                    self.sleep(delay)
+                
+                output = self.render_diff(char_indices, color_indices)
+                self.out.write(output)
+                self.out.flush()
+                written_bytes += len(output.encode('utf-8'))
+                shown_frames += 1
+        finally:
+            height = 0 if self.screen_chars is None else self.screen_chars.shape[0]
+            self.out.write(f"{self.converter.reset_color}\033[{height + 1};1H\033[?25h")
+            self.out.flush()
+        
+        elapsed = self.clock() - start
+        return {
+            "shown_frames": shown_frames,
+            "dropped_frames": dropped_frames,
+            "fps": shown_frames / elapsed if elapsed > 0 else 0.0,
+            "written_bytes": written_bytes,
+        }
+
+def play_container(path, fps=None, out=None):
+    """Воспроизводит контейнер .ascv в терминале и печатает статистику"""
+    # Включаем обработку ANSI последовательностей в консоли Windows
+    if platform.system() == "Windows":
+        os.system("")
+    if out is None and hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding='utf-8')
+    
+    with ASCIIContainer(path) as container:
+        player = TerminalPlayer(container.converter, out, fps or container.fps)
+        stats = player.play(container, len(container))
+    
+    print(f"Показано кадров: {stats['shown_frames']}, пропущено: {stats['dropped_frames']}, "
+          f"FPS: {stats['fps']:.1f}, выведено байт: {stats['written_bytes']}")
+    return stats
+
+class FrameGrabber(threading.Thread):
+    """Читает кадры источника в отдельном потоке и хранит только самые свежие"""
+    
+    def __init__(self, cap, max_queue=2, source_fps=None):
+        super().__init__(daemon=True)
+        self.cap = cap
+        # source_fps задается для файлов, чтобы читать их с родной скоростью
+        self.source_fps = source_fps
+        
+        # Очередь с вытеснением самых старых кадров: медленный потребитель не копит задержку
+        self.frames = deque(maxlen=max_queue)
+        self.condition = threading.Condition()
+        self.finished = False
+        self.stop_event = threading.Event()
+        self.read_frames = 0
+        self.dropped_frames = 0
+    
+    def run(self):
+        start = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                if self.source_fps:
+                    delay = start + self.read_frames / self.source_fps - time.monotonic()
+                    # Ожидание прерывается остановкой
+                    if delay > 0 and self.stop_event.wait(delay):
+                        break
+                
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                
+                with self.condition:
+                    if len(self.frames) == self.frames.maxlen:
+                        self.dropped_frames += 1
+                    # Время захвата - начало отсчета задержки до вывода
+                    self.frames.append((time.monotonic(), self.read_frames, frame))
+                    self.read_frames += 1
+                    self.condition.notify()
+        finally:
+            self.cap.release()
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+    
+    def get(self):
+        """Возвращает самый старый из сохраненных кадров или None, если источник закончился"""
+        with self.condition:
+            while not self.frames and not self.finished:
+                self.condition.wait()
+            return self.frames.popleft() if self.frames else None
+    
+    def stop(self):
+        """Останавливает чтение и ждет поток не дольше GRABBER_JOIN_TIMEOUT секунд"""
+        self.stop_event.set()
+        self.join(GRABBER_JOIN_TIMEOUT)
+
+def find_font_path():
+    """Возвращает первый найденный моноширинный шрифт для калибровки или None"""
+    # Путь ищется без PIL, потому что ключ калибровки нужен уже при создании конвертера
+    for font_path in FONT_PATHS:
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+def open_source(source):
+    """Открывает источник cv2.VideoCapture: путь, номер устройства или строку конвейера"""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Не удалось открыть источник: {source}")
+    return cap
+
+def open_output(target=None):
+    """Открывает вывод: stdout по умолчанию или TCP сокет в виде tcp:host:port"""
+    if target is None or target == "-":
+        if hasattr(sys.stdout, "reconfigure"):
+            sys.stdout.reconfigure(encoding='utf-8')
+        return sys.stdout
+    
+    if target.startswith("tcp:"):
+        host, port = target[len("tcp:"):].rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+        output = connection.makefile('w', encoding='utf-8')
+        # Сокет закроется вместе с файлом, который его использует
+        connection.close()
+        return output
+    
+    raise ValueError(f"Неизвестный вывод: {target}")
+
+def stream_live(source, width=120, height=30, out=None, max_queue=2, max_frames=None, converter=None, output=None):
+    """Показывает ASCII кадры источника по мере их поступления и возвращает статистику задержки"""
+    # out - уже открытый вывод, иначе открывается output (stdout или tcp:host:port) и закрывается в конце
+    converter = converter or VideoToASCII()
+    cap = open_source(source)
+    
+    # Файлы воспроизводятся с родной скоростью, камеры и потоки - как приходят кадры
+    source_fps = None
+    if isinstance(source, str) and os.path.isfile(source):
+        source_fps = cap.get(cv2.CAP_PROP_FPS) or None
+    
+    grabber = FrameGrabber(cap, max_queue, source_fps)
+    own_output = out is None
+    try:
+        player = TerminalPlayer(converter, out if out is not None else open_output(output))
+    except Exception:
+        cap.release()
+        raise
+    seed = random.randrange(2 ** 32)
+    latencies = []
+    
+    if platform.system() == "Windows":
+        os.system("")
+    
+    grabber.start()
+    player.out.write("\033[?25l")  # Скрываем курсор
+    try:
+        while max_frames is None or len(latencies) < max_frames:
+            item = grabber.get()
+            if item is None:
+                break
+            
+            captured, frame_number, frame = item
+            char_indices, color_indices = converter.convert_frame(frame_number, frame, width, height, seed)
+            player.out.write(player.render_diff(char_indices, color_indices))
+            player.out.flush()
+            latencies.append(time.monotonic() - captured)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grabber.stop()
+        try:
+            player.out.write(f"{converter.reset_color}\033[{height + 1};1H\033[?25h")
+            player.out.flush()
+        finally:
+            if own_output and player.out is not sys.stdout:
+                player.out.close()
+    
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "shown_frames": len(latencies),
+        "dropped_frames": grabber.dropped_frames,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)) if len(latencies) else 0.0,
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0,
+    }
+
+class BufferedBlockWriter:
+    """Собирает текст кадров в крупные блоки и пишет их одним вызовом, замеряя время записи"""
+    
+    # Размер блока и буфера файла
+    BLOCK_SIZE = 1024 * 1024
+    
+    def __init__(self, metrics=None):
+        self.metrics = metrics or NullMetrics()
+        self.pending = {}
+        self.seconds = 0.0
+    
+    def write(self, file, text):
+        parts, size = self.pending.get(file, ([], 0))
+        parts.append(text)
+        size += len(text)
+        self.pending[file] = (parts, size)
+        if size >= self.BLOCK_SIZE:
+            self.flush(file)
+    
+    def flush(self, file):
+        parts, _ = self.pending.pop(file, ([], 0))
+        if not parts:
+            return
+        start = time.perf_counter()
+        file.write("".join(parts))
+        elapsed = time.perf_counter() - start
+        self.seconds += elapsed
+        self.metrics.add_time("write", elapsed)
+    
+    def close(self, file):
+        """Дописывает остаток блока и закрывает файл; время закрытия тоже считается записью"""
+        self.flush(file)
+        start = time.perf_counter()
+        file.close()
+        self.seconds += time.perf_counter() - start
+
+def convert(inputs, output_format="bat", width=180, height=60, fps=30, max_frames=5000, workers=1, seed=None, output_dir=None, dither="random", metrics=None, chunk_frames=500):
+    """Конвертирует видео без GUI и возвращает список пар (видео, созданный файл)"""
+    converter = VideoToASCII()
+    converter.dither = dither
+    # metrics - Metrics с callback для прогресса и ETA или None
+    if metrics is not None:
+        converter.metrics = metrics
+    results = []
+    for video_path in Common.find_videos(inputs):
+        output_file, _ = converter.process_video(
+            video_path, max_frames, width, height, fps, workers, seed, output_format, output_dir, chunk_frames)
+        results.append((video_path, output_file))
+    return results
+
+def run_gui(workers=1):
+    """Интерактивный режим: выбор файла в диалоге и сообщение о результате"""
+    import tkinter as tk
+    from tkinter import messagebox
+    
     converter = VideoToASCII()
     
     print("=== Видео в ASCII конвертер с цветами ===")
@@ -223,6 +934,7 @@ def main():
         print("- FPS: 10")
         print("- Цвета: Включены")
         print("- Случайные символы: Включены")
+        print(f"- Процессов: {workers}")
         
         # Обрабатываем видео
         bat_file, output_dir = converter.process_video(
@@ -230,7 +942,8 @@ def main():
             max_frames=5000, 
             width=180, 
             height=60, 
-            fps=30
+            fps=30,
+            workers=workers
         )
         
         print(f"\nКонвертация завершена!")
@@ -261,5 +974,77 @@ def main():
         print(f"Ошибка при обработке видео: {e}")
         messagebox.showerror("Ошибка", f"Не удалось обработать видео:\n{e}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Конвертер видео в цветной ASCII (BAT или .ascv)")
+    parser.add_argument("inputs", nargs="*", help="видео файлы, папки или маски вида *.mp4")
+    parser.add_argument("--format", choices=["bat", "ascv"], default="bat", help="формат вывода")
+    parser.add_argument("--width", type=int, default=180, help="ширина ASCII сетки в символах")
+    parser.add_argument("--height", type=int, default=60, help="высота ASCII сетки в символах")
+    parser.add_argument("--fps", type=float, default=30, help="частота кадров воспроизведения")
+    parser.add_argument("--max-frames", type=int, default=5000, help="максимум кадров из одного видео")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов конвертации")
+    parser.add_argument("--chunk-frames", type=int, default=500, help="кадров в одной части BAT файла (0 - один файл)")
+    parser.add_argument("--seed", type=int, help="seed случайных символов для повторяемого результата")
+    parser.add_argument("--dither", choices=["random", "ordered", "blue"], default="random",
+                        help="узор разброса символов: случайный, матрица Байера или синий шум")
+    parser.add_argument("--output-dir", help="папка для результатов (по умолчанию рядом с видео)")
+    parser.add_argument("--metrics", metavar="FILE", help="писать метрики этапов и прогресс в файл JSON lines")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="период записи метрик в секундах")
+    parser.add_argument("--calibrate", action="store_true", help="отсортировать символы по плотности глифов и сохранить калибровку")
+    parser.add_argument("--gui", action="store_true", help="выбрать файл в диалоге (режим по умолчанию без входных файлов)")
+    parser.add_argument("--play", metavar="FILE", help="воспроизвести контейнер .ascv в терминале")
+    parser.add_argument("--live", metavar="SOURCE", help="показывать ASCII с камеры, файла или потока в реальном времени")
+    parser.add_argument("--live-output", metavar="TARGET", help="вывод живого режима: - (stdout) или tcp:host:port")
+    args = parser.parse_args(argv)
+    
+    if args.calibrate:
+        # Калибровка сохраняется в файл и подхватывается всеми следующими конвертерами
+        entry = VideoToASCII().calibrate_charset()
+        print(f"Калибровка сохранена: {Common.CALIBRATION_FILE}")
+        print(f"Символы по возрастанию плотности: {entry['charset']}")
+        if not args.inputs:
+            return 0
+    
+    if args.play:
+        play_container(args.play)
+        return 0
+    
+    if args.live:
+        converter = VideoToASCII()
+        converter.dither = args.dither
+        stats = stream_live(args.live, args.width, args.height, converter=converter, output=args.live_output)
+        print(f"Показано кадров: {stats['shown_frames']}, отброшено: {stats['dropped_frames']}, "
+              f"задержка p50/p95/p99: {stats['latency_p50_ms']:.1f}/{stats['latency_p95_ms']:.1f}/"
+              f"{stats['latency_p99_ms']:.1f} мс", file=sys.stderr)
+        return 0
+    
+    if args.gui or not args.inputs:
+        run_gui(args.workers)
+        return 0
+    
+    videos = Common.find_videos(args.inputs)
+    if not videos:
+        print("Не найдено ни одного видео файла", file=sys.stderr)
+        return 1
+    
+    # Ошибка в одном файле не останавливает обработку остальных
+    converter = VideoToASCII()
+    converter.dither = args.dither
+    if args.metrics:
+        converter.metrics = Metrics(args.metrics, args.metrics_interval)
+    failed = 0
+    for video_path in videos:
+        try:
+            output_file, _ = converter.process_video(
+                video_path, args.max_frames, args.width, args.height, args.fps,
+                args.workers, args.seed, args.format, args.output_dir, args.chunk_frames)
+            print(f"Готово: {video_path} -> {output_file}")
+        except Exception as e:
+            failed += 1
+            print(f"Ошибка при обработке {video_path}: {e}", file=sys.stderr)
+    
+    print(f"Обработано видео: {len(videos) - failed}/{len(videos)}")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -2,15 +2,34 @@
 import cv2
 import numpy as np
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import argparse
+import hashlib
+import json
+import queue
+import shutil
 import subprocess
 import platform
+import sys
 import random
 import string
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
 
-class VideoToASCII:
+# Общий модуль лежит рядом со скриптом; процессы пула при spawn получают тот же sys.path
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+from Common import Metrics, NullMetrics
+
+class VideoToASCII(Common.CalibrationMixin, Common.DitherMixin):
+    # Наибольший случайный сдвиг индекса символа в режиме random
+    jitter = 1
+    
     def __init__(self):
         # Расширенный набор ASCII символов для более разнообразного вывода
         self.ascii_chars = " .:-=+*#%@"  # Упрощенный набор для лучшей читаемости
@@ -21,9 +40,44 @@ class VideoToASCII:
         self.font_size = 8
         self.char_width = 6
         self.char_height = 12
-        
+
+        # Кэш таблиц яркость -> символ для векторизованной конвертации
+        self._lut_cache = {}
+        
+        # Кэш атласа заранее отрисованных символов
+        self._atlas_cache = {}
+        
+        # Узор разброса символов: random (свой для каждого кадра), ordered (матрица Байера)
+        # или blue (синий шум); узоры привязаны к ячейкам и не мерцают на неподвижной картинке
+        self.dither = "random"
+        self._dither_cache = {}
+        
+        # Выбор символа: brightness (по средней яркости ячейки) или shape (по форме блока пикселей)
+        self.engine = "brightness"
+        # Размер блока признаков ячейки (строки x столбцы) и вес перепадов яркости в сравнении
+        self.feature_block = (6, 3)
+        self.edge_weight = 0.5
+        self._feature_cache = {}
+        
+        # Набор символов, отсортированный калибровкой по плотности глифов, если она сохранена;
+        # исходный набор остается ключом калибровки и началом повторной калибровки
+        self.base_chars = self.ascii_chars
+        self.load_calibration()
+        
+        # Метрики этапов; по умолчанию выключены и ничего не стоят
+        self.metrics = NullMetrics()
+        # Печать прогресса записи; To All.py выключает ее, чтобы строки получателей не перемешивались
+        self.show_progress = True
+        
+        # Минимальный пропуск кадров, при котором имеет смысл пробовать перемотку
+        self.min_seek_gap = 8
+
     def get_video_file(self):
         """Открывает диалог выбора видео файла"""
+        # tkinter загружается только для GUI, чтобы скрипт работал на серверах без дисплея
+        import tkinter as tk
+        from tkinter import filedialog
+        
         root = tk.Tk()
         root.withdraw()  # Скрываем главное окно
         
@@ -44,7 +98,7 @@ class VideoToASCII:
             # Используем случайный символ с весом, основанным на яркости
             index = min(int(pixel_value / 255 * len(self.ascii_chars)), len(self.ascii_chars) - 1)
             # Добавляем элемент случайности
-            random_offset = random.randint(-1, 1)
+            random_offset = random.randint(-self.jitter, self.jitter)
             index = max(0, min(len(self.ascii_chars) - 1, index + random_offset))
             return self.ascii_chars[index]
         else:
@@ -59,113 +113,327 @@ class VideoToASCII:
         # Возвращаем RGB цвет для использования в PIL
         return (r, g, b)
     
-    def frame_to_ascii(self, frame, width=120, height=60, use_colors=True, use_random=True):
+    def calibration_key(self):
+        """Ключ калибровки: исходный набор символов, шрифт и размер ячейки"""
+        return f"{self.font_size}:{self.char_width}x{self.char_height}|{self.get_font_path()}|{self.base_chars}"
+    
+    def measure_coverage(self):
+        """Возвращает долю закрашенных пикселей каждого символа в атласе"""
+        # Атлас растеризован тем же шрифтом, которым рисуются кадры
+        return self.get_glyph_atlas().mean(axis=(1, 2)) / 255
+    
+    def get_block_features(self, blocks):
+        """Признаки блоков (n, строки, столбцы) в 0..1: сами пиксели и перепады по горизонтали и вертикали"""
+        dx = blocks[:, :, 1:] - blocks[:, :, :-1]
+        dy = blocks[:, 1:, :] - blocks[:, :-1, :]
+        count = len(blocks)
+        return np.hstack([blocks.reshape(count, -1),
+                          self.edge_weight * dx.reshape(count, -1),
+                          self.edge_weight * dy.reshape(count, -1)])
+    
+    def get_glyph_features(self):
+        """Возвращает матрицу признаков символов (символы x признаки) и квадраты их норм"""
+        key = (self.ascii_chars, self.font_size, self.char_width, self.char_height, self.feature_block, self.edge_weight)
+        if key not in self._feature_cache:
+            block_height, block_width = self.feature_block
+            # Маски атласа уменьшаются до блока признаков так же, как кадр
+            masks = np.stack([cv2.resize(mask, (block_width, block_height), interpolation=cv2.INTER_AREA)
+                              for mask in self.get_glyph_atlas()]).astype(np.float32) / 255
+            features = self.get_block_features(masks)
+            self._feature_cache[key] = features, (features ** 2).sum(axis=1)
+        return self._feature_cache[key]
+    
+    def match_glyphs(self, frame, width, height):
+        """Подбирает для каждой ячейки символ, ближайший по форме к ее блоку пикселей"""
+        glyph_features, glyph_norms = self.get_glyph_features()
+        block_height, block_width = self.feature_block
+        
+        # Каждая ячейка - блок block_height x block_width пикселей уменьшенного кадра
+        gray = cv2.cvtColor(cv2.resize(frame, (width * block_width, height * block_height), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY).astype(np.float32) / 255
+        blocks = gray.reshape(height, block_height, width, block_width).transpose(0, 2, 1, 3)
+        cell_features = self.get_block_features(blocks.reshape(-1, block_height, block_width))
+        
+        # ||блок - символ||^2 = ||блок||^2 - 2 блок·символ + ||символ||^2; первое слагаемое
+        # одинаково для всех символов ячейки, поэтому хватает одного умножения матриц
+        scores = glyph_norms - 2 * (cell_features @ glyph_features.T)
+        return scores.argmin(axis=1).reshape(height, width)
+    
+    def frame_to_indices(self, frame, width=120, height=60, use_colors=True, use_random=True, rng=None):
+        """Конвертирует кадр в массив индексов символов и массив RGB цветов"""
+        with self.metrics.stage("resize"):
+            # Изменяем размер кадра
+            frame_resized = cv2.resize(frame, (width, height))
+
+            # Конвертируем в оттенки серого для определения яркости
+            gray_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
+
+        with self.metrics.stage("map"):
+            # Один проход по таблице вместо вызова pixel_to_ascii для каждой ячейки
+            if self.engine == "shape":
+                char_indices = self.match_glyphs(frame, width, height)
+            elif use_random:
+                char_indices = self.dither_indices(gray_frame, rng)
+            else:
+                char_indices = self.get_char_lut(False)[gray_frame]
+
+            if use_colors:
+                colors = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
+            else:
+                colors = np.full((height, width, 3), 255, dtype=np.uint8)  # Белый цвет
+
+        return char_indices, colors
+
+    def indices_to_ascii(self, char_indices):
+        """Собирает строки кадра из массива индексов символов"""
+        chars = np.array(list(self.ascii_chars), dtype=object)
+        return ["".join(row) for row in chars[char_indices]]
+
+    def frame_to_ascii(self, frame, width=120, height=60, use_colors=True, use_random=True, rng=None):
         """Конвертирует кадр в ASCII"""
-        # Изменяем размер кадра
-        frame_resized = cv2.resize(frame, (width, height))
-        
-        # Конвертируем в оттенки серого для определения яркости
-        gray_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
-        
-        ascii_frame = []
-        colors_frame = []
-        
-        for y in range(height):
-            row = ""
-            color_row = []
-            for x in range(width):
-                pixel_value = gray_frame[y, x]
-                ascii_char = self.pixel_to_ascii(pixel_value, use_random)
-                row += ascii_char
-                
-                if use_colors:
-                    color = self.get_color_from_pixel(frame_resized[y, x])
-                    color_row.append(color)
-                else:
-                    color_row.append((255, 255, 255))  # Белый цвет
-            
-            ascii_frame.append(row)
-            colors_frame.append(color_row)
-        
+        char_indices, colors = self.frame_to_indices(frame, width, height, use_colors, use_random, rng)
+
+        ascii_frame = self.indices_to_ascii(char_indices)
+        colors_frame = [list(map(tuple, row)) for row in colors.tolist()]
+
         return ascii_frame, colors_frame
     
-    def ascii_to_image(self, ascii_frame, colors_frame, output_width=1920, output_height=1080):
-        """Конвертирует ASCII кадр в изображение"""
-        # Создаем черное изображение
-        img = Image.new('RGB', (output_width, output_height), color='black')
-        draw = ImageDraw.Draw(img)
-        
+    def load_font(self):
+        """Загружает моноширинный шрифт для отрисовки символов"""
         # Пытаемся использовать моноширинный шрифт
         try:
             # Для Windows
-            font = ImageFont.truetype("consola.ttf", self.font_size)
+            return ImageFont.truetype("consola.ttf", self.font_size)
         except:
             try:
                 # Для Linux
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf", self.font_size)
+                return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf", self.font_size)
             except:
                 try:
                     # Для macOS
-                    font = ImageFont.truetype("/System/Library/Fonts/Monaco.ttf", self.font_size)
+                    return ImageFont.truetype("/System/Library/Fonts/Monaco.ttf", self.font_size)
                 except:
                     # Используем стандартный шрифт
-                    font = ImageFont.load_default()
-        
-        # Вычисляем размеры символов
-        char_width = self.char_width
-        char_height = self.char_height
-        
-        # Вычисляем отступы для центрирования
-        total_width = len(ascii_frame[0]) * char_width
-        total_height = len(ascii_frame) * char_height
-        start_x = (output_width - total_width) // 2
-        start_y = (output_height - total_height) // 2
-        
-        # Рисуем ASCII символы
-        for y, (line, color_line) in enumerate(zip(ascii_frame, colors_frame)):
-            for x, (char, color) in enumerate(zip(line, color_line)):
-                if char != ' ':  # Не рисуем пробелы
-                    pos_x = start_x + x * char_width
-                    pos_y = start_y + y * char_height
-                    draw.text((pos_x, pos_y), char, fill=color, font=font)
-        
-        # Конвертируем PIL изображение в формат OpenCV
-        cv_image = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        return cv_image
-    
-    def create_ascii_video(self, video_path, ascii_frames, colors_frames, fps=30, output_width=1920, output_height=1080):
+                    return ImageFont.load_default()
+    
+    def get_font_path(self):
+        """Возвращает путь к шрифту, который выбирает load_font, или default для встроенного"""
+        path = getattr(self.load_font(), "path", None)
+        return path if isinstance(path, str) else "default"
+    
+    def get_glyph_atlas(self):
+        """Возвращает атлас символов: маски прозрачности размером char_height x char_width"""
+        key = (self.ascii_chars, self.font_size, self.char_width, self.char_height)
+        if key not in self._atlas_cache:
+            font = self.load_font()
+            atlas = np.zeros((len(self.ascii_chars), self.char_height, self.char_width), dtype=np.uint8)
+            
+            # Каждый символ растеризуется один раз, а не для каждой ячейки каждого кадра
+            for i, char in enumerate(self.ascii_chars):
+                if char != ' ':  # Пробел остается пустым
+                    mask = Image.new('L', (self.char_width, self.char_height), color=0)
+                    ImageDraw.Draw(mask).text((0, 0), char, fill=255, font=font)
+                    atlas[i] = np.array(mask)
+            
+            self._atlas_cache[key] = atlas
+        return self._atlas_cache[key]
+    
+    def get_grid_size(self, width, height):
+        """Размер сетки символов в пикселях"""
+        return width * self.char_width, height * self.char_height
+    
+    def render_grid(self, char_indices, colors):
+        """Собирает сетку символов из атласа по массивам индексов и цветов"""
+        atlas = self.get_glyph_atlas()
+        height, width = char_indices.shape
+        char_height, char_width = atlas.shape[1:]
+        
+        # Плитки символов (height, width, char_height, char_width) -> маска всей сетки
+        mask = atlas[char_indices].transpose(0, 2, 1, 3).reshape(height * char_height, width * char_width)
+        
+        # Растягиваем цвет ячейки на ее плитку и умножаем на маску символа
+        cell_colors = cv2.cvtColor(colors, cv2.COLOR_RGB2BGR)
+        cell_colors = cv2.resize(cell_colors, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_NEAREST)
+        return cv2.multiply(cell_colors, cv2.merge([mask, mask, mask]), scale=1 / 255)
+    
+    def check_grid_fits(self, grid_width, grid_height, output_width, output_height):
+        """Проверяет, что сетка символов помещается в кадр: обрезка потеряла бы крайние символы"""
+        if grid_width > output_width or grid_height > output_height:
+            raise ValueError(f"Сетка символов {grid_width}x{grid_height} пикс. не помещается в кадр {output_width}x{output_height}")
+    
+    def place_grid(self, grid, output_width=1920, output_height=1080, out=None):
+        """Размещает сетку символов по центру черного изображения (out - готовый буфер изображения)"""
+        self.check_grid_fits(grid.shape[1], grid.shape[0], output_width, output_height)
+        if out is None:
+            image = np.zeros((output_height, output_width, 3), dtype=np.uint8)
+        else:
+            image = out
+            image[:] = 0
+        start_x = (output_width - grid.shape[1]) // 2
+        start_y = (output_height - grid.shape[0]) // 2
+        image[start_y:start_y + grid.shape[0], start_x:start_x + grid.shape[1]] = grid
+        return image
+    
+    def render_frame(self, char_indices, colors, output_width=1920, output_height=1080, out=None):
+        """Собирает изображение кадра из атласа символов по массивам индексов и цветов"""
+        return self.place_grid(self.render_grid(char_indices, colors), output_width, output_height, out)
+    
+    def ascii_to_image(self, ascii_frame, colors_frame, output_width=1920, output_height=1080):
+        """Конвертирует ASCII кадр в изображение"""
+        # Переводим строки обратно в индексы символов атласа
+        char_to_index = {char: i for i, char in enumerate(self.ascii_chars)}
+        char_indices = np.array([[char_to_index[char] for char in line] for line in ascii_frame], dtype=np.intp)
+        colors = np.array(colors_frame, dtype=np.uint8)
+        
+        return self.render_frame(char_indices, colors, output_width, output_height)
+    
+    def create_ascii_video(self, video_path, frames, fps=30, output_width=1920, output_height=1080, frame_count=None, output_dir=None,
+                           encoder="mp4v", preset="medium", crf=18, lossless=False, scale=1, queue_size=8):
         """Создает видео файл из ASCII кадров"""
+        # frames - уже отрисованные BGR изображения, может быть генератором
+        if frame_count is None:
+            frame_count = len(frames)
+
         video_name = os.path.splitext(os.path.basename(video_path))[0]
-        output_dir = os.path.join(os.path.dirname(video_path), f"{video_name}_ascii")
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(video_path), f"{video_name}_ascii")
         
         # Создаем папку для вывода
         os.makedirs(output_dir, exist_ok=True)
         
         output_filename = os.path.join(output_dir, f"{video_name}_ascii.mp4")
         
-        # Настройки для записи видео
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_filename, fourcc, fps, (output_width, output_height))
+        # Без ffmpeg остается встроенный кодировщик OpenCV
+        if encoder != "mp4v" and shutil.which("ffmpeg") is None:
+            print(f"ffmpeg не найден, вместо {encoder} используется mp4v")
+            encoder = "mp4v"
+        
+        # Целочисленное увеличение делает кодировщик; для mp4v кадры увеличиваются перед записью
+        if encoder == "mp4v":
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            writer = cv2.VideoWriter(output_filename, fourcc, fps, (output_width * scale, output_height * scale))
+            if scale > 1:
+                frames = (cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST) for img in frames)
+        else:
+            writer = FFmpegWriter(output_filename, fps, output_width, output_height, encoder, preset, crf, lossless, scale)
         
-        print(f"Создание видео файла: {output_filename}")
+        print(f"Создание видео файла: {output_filename} ({encoder})")
         
-        for i, (ascii_frame, colors_frame) in enumerate(zip(ascii_frames, colors_frames)):
-            # Конвертируем ASCII кадр в изображение
-            img = self.ascii_to_image(ascii_frame, colors_frame, output_width, output_height)
-            
-            # Записываем кадр в видео
-            out.write(img)
-            
-            if (i + 1) % 10 == 0:
-                print(f"Записано кадров: {i + 1}/{len(ascii_frames)}")
+        # Кодирование идет в отдельном потоке параллельно с отрисовкой следующих кадров
+        encoder_thread = EncoderThread(writer, queue_size, self.metrics)
+        encoder_thread.start()
+        written = 0
+        try:
+            for i, img in enumerate(frames):
+                encoder_thread.put(img)
+                written = i + 1
+                
+                if self.show_progress and written % 10 == 0:
+                    print(f"Записано кадров: {written}/{frame_count}")
+        finally:
+            encoder_thread.close()
         
-        out.release()
         print(f"Видео файл создан: {output_filename}")
         
+        # Скорость считается по времени работы кодировщика, битрейт - по длительности видео
+        if written and encoder_thread.busy_seconds > 0:
+            bitrate = os.path.getsize(output_filename) * 8 / (written / fps)
+            print(f"Кодирование: {written / encoder_thread.busy_seconds:.1f} кадр/с, битрейт {bitrate / 1000:.0f} кбит/с")
+        self.metrics.count("bytes_out", os.path.getsize(output_filename))
+        
         return output_filename, output_dir
     
-    def process_video(self, video_path, max_frames=300, width=120, height=60, fps=30, output_width=1920, output_height=1080):
+    def convert_frame(self, frame_number, frame, width, height, seed, output_width=1920, output_height=1080, indices=None, out=None):
+        """Конвертирует и отрисовывает один кадр; случайность зависит только от seed и номера кадра"""
+        # Готовые индексы (например, из кэша) только отрисовываются
+        if indices is None:
+            rng = np.random.default_rng([seed, frame_number])
+            indices = self.frame_to_indices(frame, width, height, use_colors=True, use_random=True, rng=rng)
+            self.metrics.count("frames_converted")
+        char_indices, colors = indices
+        with self.metrics.stage("render"):
+            image = self.render_frame(char_indices, colors, output_width, output_height, out)
+        return char_indices, colors, image
+    
+    def iter_rendered_frames(self, frames, width, height, seed, output_width=1920, output_height=1080, workers=1):
+        """Конвертирует и отрисовывает поток (номер кадра, кадр, индексы), при workers > 1 - в пуле процессов"""
+        options = (width, height, seed, output_width, output_height)
+        if workers <= 1:
+            for frame_number, frame, indices in frames:
+                yield frame_number, self.convert_frame(frame_number, frame, *options, indices)
+            return
+        
+        # Процессы пула рисуют кадры в слоты общей памяти: через pickle возвращаются только индексы и цвета.
+        # Слот переиспользуется не раньше, чем основной процесс скопирует из него кадр
+        slots = workers * 2
+        canvases = Common.SharedCanvases(slots, (output_height, output_width, 3))
+        try:
+            with ProcessPoolExecutor(workers, initializer=Common.init_worker, initargs=Common.worker_initargs(self, canvases)) as pool:
+                # Очередь задач в порядке кадров служит буфером переупорядочивания:
+                # результат отдается только когда готов самый ранний кадр
+                pending = deque()
+                for sequence, (frame_number, frame, indices) in enumerate(frames):
+                    slot = sequence % slots
+                    pending.append((frame_number, slot, pool.submit(Common.render_in_worker, slot, frame_number, frame, *options, indices)))
+                    if len(pending) >= slots:
+                        yield self.take_rendered_frame(pending.popleft(), canvases)
+                
+                while pending:
+                    yield self.take_rendered_frame(pending.popleft(), canvases)
+        finally:
+            canvases.close()
+    
+    def take_rendered_frame(self, task, canvases):
+        """Возвращает (номер кадра, результат) задачи пула с копией изображения из ее слота"""
+        frame_number, slot, future = task
+        char_indices, colors, _ = Common.take_worker_result(future, self.metrics)
+        return frame_number, (char_indices, colors, canvases.array[slot].copy())
+    
+    def iter_cached_frames(self, cap, frame_numbers, cache, cache_keys, video_path):
+        """Отдает (номер кадра, кадр, индексы): индексы читаются из кэша по мере вывода, остальные кадры декодируются"""
+        # Наличие записей проверяется без чтения массивов: в памяти не держится весь кэш видео
+        missing = [frame_number for frame_number in frame_numbers if not cache.contains(cache_keys[frame_number])]
+        print(f"Кадров в кэше: {len(frame_numbers) - len(missing)}/{len(frame_numbers)}")
+        
+        # Если все кадры в кэше, видео вообще не декодируется
+        if not missing:
+            cap.release()
+        decoded = Common.iter_video_frames(cap, missing, self.metrics, self.min_seek_gap, self.show_progress) if missing else iter(())
+        missing = set(missing)
+        
+        for frame_number in frame_numbers:
+            if frame_number in missing:
+                decoded_number, frame = next(decoded, (None, None))
+                if decoded_number is None:
+                    return
+                yield decoded_number, frame, None
+                continue
+            
+            indices = cache.get(cache_keys[frame_number])
+            if indices is not None:
+                self.metrics.count("frames_cached")
+                yield frame_number, None, indices
+                continue
+            
+            # Запись удалена или испорчена после проверки - кадр декодируется отдельно
+            for decoded_number, frame in Common.iter_video_frames(cv2.VideoCapture(video_path), [frame_number], self.metrics, self.min_seek_gap, self.show_progress):
+                yield decoded_number, frame, None
+    
+    def iter_storing_frames(self, frames, cache, cache_keys):
+        """Сохраняет индексы кадров в кэш и отдает отрисованные изображения"""
+        for frame_number, (char_indices, colors, image) in frames:
+            cache.put(cache_keys[frame_number], char_indices, colors)
+            yield image
+    
+    def process_video(self, video_path, max_frames=300, width=120, height=60, fps=30, output_width=1920, output_height=1080, workers=1, seed=None, output_dir=None, cache=None, incremental=False, encoder_settings=None):
         """Обрабатывает видео и конвертирует в ASCII видео"""
+        # Без размера кадра он равен сетке символов: нет черных полей, которые тоже нужно кодировать
+        grid_width, grid_height = self.get_grid_size(width, height)
+        if output_width is None or output_height is None:
+            output_width, output_height = grid_width, grid_height
+        # Проверка до открытия видео и запуска пула: иначе ошибка возникла бы на первом кадре
+        self.check_grid_fits(grid_width, grid_height, output_width, output_height)
+        
         print(f"Обработка видео: {video_path}")
         
         cap = cv2.VideoCapture(video_path)
@@ -179,35 +447,48 @@ class VideoToASCII:
         print(f"Оригинальный FPS: {original_fps}")
         
         # Ограничиваем количество кадров для производительности
-        frames_to_process = min(max_frames, total_frames)
-        frame_step = max(1, total_frames // frames_to_process)
-        
-        ascii_frames = []
-        colors_frames = []
-        frame_count = 0
-        processed_frames = 0
+        frame_numbers = Common.get_sample_frames(total_frames, max_frames)
+        frames_to_process = len(frame_numbers)
+        self.metrics.start_job(video_path, frames_to_process)
+        
+        # Общий seed делает результат одинаковым при любом числе процессов;
+        # с кэшем seed по умолчанию постоянный, иначе кадры не совпадут между запусками
+        if seed is None:
+            seed = 0 if cache is not None else random.randrange(2 ** 32)
+        
+        # Кадры читаются (или берутся из кэша), конвертируются, отрисовываются и записываются по одному
+        if cache is not None:
+            source_hash = cache.source_hash(video_path)
+            cache_keys = {n: cache.frame_key(source_hash, n, width, height, self.ascii_chars, seed, incremental, self.dither, self.engine,
+                                          self.feature_block, self.edge_weight) for n in frame_numbers}
+            frames = self.iter_cached_frames(cap, frame_numbers, cache, cache_keys, video_path)
+        else:
+            frames = ((frame_number, frame, None) for frame_number, frame in Common.iter_video_frames(cap, frame_numbers, self.metrics, self.min_seek_gap, self.show_progress))
         
-        while cap.isOpened() and processed_frames < frames_to_process:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count % frame_step == 0:
-                ascii_frame, colors_frame = self.frame_to_ascii(frame, width, height, use_colors=True, use_random=True)
-                ascii_frames.append(ascii_frame)
-                colors_frames.append(colors_frame)
-                processed_frames += 1
-                
-                if processed_frames % 10 == 0:
-                    print(f"Обработано кадров: {processed_frames}/{frames_to_process}")
-            
-            frame_count += 1
+        # Пошаговая отрисовка зависит от предыдущего кадра, поэтому идет в одном процессе
+        renderer = None
+        if incremental:
+            renderer = IncrementalRenderer(self, width, height, output_width, output_height)
+            frames = renderer.iter_rendered_frames(frames, seed)
+        else:
+            frames = self.iter_rendered_frames(frames, width, height, seed, output_width, output_height, workers)
         
-        cap.release()
-        print(f"Обработка завершена. Создано {len(ascii_frames)} ASCII кадров")
+        if cache is not None:
+            frames = self.iter_storing_frames(frames, cache, cache_keys)
+        else:
+            frames = (image for _, (_, _, image) in frames)
         
         # Создаем видео файл
-        video_file, output_dir = self.create_ascii_video(video_path, ascii_frames, colors_frames, fps, output_width, output_height)
+        # encoder_settings - параметры create_ascii_video: encoder, preset, crf, lossless, scale
+        video_file, output_dir = self.create_ascii_video(
+            video_path, frames, fps, output_width, output_height, frames_to_process, output_dir, **(encoder_settings or {}))
+        
+        if renderer is not None:
+            print(f"Переиспользовано ячеек: {renderer.reused_fraction:.1%}")
+        
+        if self.metrics.enabled:
+            print(f"Этапы: {self.metrics.summary()}")
+            self.metrics.dump()
         
         return video_file, output_dir
     
@@ -223,7 +504,368 @@ class VideoToASCII:
         except Exception as e:
             print(f"Не удалось открыть папку: {e}")
 
-def main():
+class FFmpegWriter:
+    """Передает BGR кадры через канал во внешний процесс ffmpeg"""
+    
+    def __init__(self, output_filename, fps, width, height, codec="libx264", preset="medium", crf=18, lossless=False, scale=1):
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", codec, "-preset", preset,
+        ]
+        if scale > 1:
+            # Увеличение без сглаживания сохраняет резкие края символов
+            command += ["-vf", f"scale=iw*{scale}:ih*{scale}:flags=neighbor"]
+        if lossless:
+            # Без потерь цвета не прореживаются: у ASCII кадров резкие цветные края
+            if codec == "libx265":
+                command += ["-x265-params", "lossless=1"]
+            else:
+                command += ["-qp", "0"]
+            command += ["-pix_fmt", "yuv444p"]
+        else:
+            command += ["-crf", str(crf), "-pix_fmt", "yuv420p"]
+        if codec == "libx265":
+            # Иначе плееры Apple не распознают HEVC в MP4
+            command += ["-tag:v", "hvc1"]
+        command.append(output_filename)
+        
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    def write(self, image):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(image).data)
+        except BrokenPipeError:
+            # ffmpeg завершился раньше времени - причина в его выводе ошибок
+            self.release()
+            raise
+    
+    def release(self):
+        if self.process.returncode is not None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        errors = self.process.stderr.read().decode(errors='replace')
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {errors.strip()}")
+
+class EncoderThread(threading.Thread):
+    """Записывает кадры в кодировщик в отдельном потоке через ограниченную очередь"""
+    
+    def __init__(self, writer, max_queue=8, metrics=None):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.metrics = metrics or NullMetrics()
+        # Ограничение очереди не дает отрисовке уйти далеко вперед и занять всю память
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.busy_seconds = 0.0
+    
+    def run(self):
+        try:
+            while True:
+                image = self.frames.get()
+                if image is None:
+                    break
+                start = time.perf_counter()
+                self.writer.write(image)
+                elapsed = time.perf_counter() - start
+                self.busy_seconds += elapsed
+                self.metrics.add_time("encode", elapsed)
+                self.metrics.frame_done()
+        except Exception as e:
+            self.error = e
+            # Освобождаем очередь, чтобы основной поток не завис на put
+            while self.frames.get() is not None:
+                pass
+        finally:
+            start = time.perf_counter()
+            try:
+                self.writer.release()
+            except Exception as e:
+                self.error = self.error or e
+            self.busy_seconds += time.perf_counter() - start
+    
+    def put(self, image):
+        if self.error is not None:
+            raise self.error
+        self.frames.put(image)
+    
+    def close(self):
+        """Дожидается записи всех кадров и пробрасывает ошибку кодировщика"""
+        self.frames.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+class IncrementalRenderer:
+    """Пошаговая отрисовка: пересчитываются и перерисовываются только изменившиеся ячейки"""
+    
+    def __init__(self, converter, width, height, output_width=1920, output_height=1080, color_tolerance=8):
+        self.converter = converter
+        self.width = width
+        self.height = height
+        self.output_width = output_width
+        self.output_height = output_height
+        # Ячейка с той же яркостью перерисовывается, если ее цвет сдвинулся больше допуска
+        self.color_tolerance = color_tolerance
+        
+        # Состояние последнего кадра: номера градаций яркости, символы, цвета и сетка
+        self.buckets = None
+        self.char_indices = None
+        self.colors = None
+        self.grid = None
+        
+        self.cells_total = 0
+        self.cells_reused = 0
+    
+    @property
+    def reused_fraction(self):
+        """Доля ячеек, взятых из предыдущего кадра без пересчета"""
+        return self.cells_reused / self.cells_total if self.cells_total else 0.0
+    
+    def convert_frame(self, frame_number, frame, seed, indices=None):
+        """Возвращает (индексы, цвета, изображение), обновляя только изменившиеся ячейки"""
+        if indices is not None:
+            # Готовые индексы из кэша: сравниваются сами символы
+            char_indices, colors = indices
+            buckets = char_indices
+        else:
+            with self.converter.metrics.stage("resize"):
+                frame_resized = cv2.resize(frame, (self.width, self.height))
+                gray_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
+            # Случайный разброс применяется к изменившимся ячейкам; узоры и подбор по форме
+            # зависят только от кадра, поэтому их результат сразу служит градацией
+            with self.converter.metrics.stage("map"):
+                if self.converter.engine == "shape":
+                    buckets = self.converter.match_glyphs(frame, self.width, self.height)
+                elif self.converter.dither == "random":
+                    buckets = self.converter.get_char_lut(True)[gray_frame]
+                else:
+                    buckets = self.converter.dither_indices(gray_frame)
+                colors = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
+            self.converter.metrics.count("frames_converted")
+        
+        if self.grid is None:
+            changed = np.ones(buckets.shape, dtype=bool)
+            self.buckets = buckets.copy()
+            self.char_indices = np.zeros(buckets.shape, dtype=np.intp)
+            self.colors = colors.copy()
+            self.grid = self.converter.render_grid(self.char_indices, self.colors)
+        else:
+            color_shift = cv2.absdiff(colors, self.colors).max(axis=2)
+            changed = (buckets != self.buckets) | (color_shift > self.color_tolerance)
+        
+        rows, columns = np.nonzero(changed)
+        self.cells_total += changed.size
+        self.cells_reused += changed.size - len(rows)
+        self.converter.metrics.count("cells_reused", changed.size - len(rows))
+        self.converter.metrics.count("cells_changed", len(rows))
+        
+        if len(rows):
+            if indices is not None:
+                new_chars = char_indices[rows, columns]
+            elif self.converter.engine == "shape" or self.converter.dither != "random":
+                new_chars = buckets[rows, columns]
+            else:
+                # Случайность та же, что и при полной конвертации, поэтому
+                # пересчитанные ячейки совпадают с результатом frame_to_indices
+                rng = np.random.default_rng([seed, frame_number])
+                offsets = rng.integers(-self.converter.jitter, self.converter.jitter + 1, size=buckets.shape)[rows, columns]
+                new_chars = np.clip(buckets[rows, columns] + offsets, 0, len(self.converter.ascii_chars) - 1)
+            
+            self.buckets[rows, columns] = buckets[rows, columns]
+            self.char_indices[rows, columns] = new_chars
+            self.colors[rows, columns] = colors[rows, columns]
+            
+            # Плитки изменившихся ячеек рисуются столбцом и копируются на свои места в сетке
+            tiles = self.converter.render_grid(new_chars[:, None], self.colors[rows, columns][:, None])
+            char_height = self.grid.shape[0] // self.height
+            char_width = self.grid.shape[1] // self.width
+            cells = self.grid.reshape(self.height, char_height, self.width, char_width, 3)
+            cells[rows, :, columns] = tiles.reshape(len(rows), char_height, char_width, 3)
+        
+        with self.converter.metrics.stage("render"):
+            image = self.converter.place_grid(self.grid, self.output_width, self.output_height)
+        return self.char_indices.copy(), self.colors.copy(), image
+    
+    def iter_rendered_frames(self, frames, seed):
+        """Отрисовывает поток (номер кадра, кадр, индексы) по порядку"""
+        for frame_number, frame, indices in frames:
+            yield frame_number, self.convert_frame(frame_number, frame, seed, indices)
+
+class FrameCache:
+    """Кэш результатов frame_to_indices на диске с вытеснением давно не использованных записей"""
+    
+    # Меняется при изменении алгоритма конвертации, чтобы старые записи не использовались
+    VERSION = 1
+    
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        # Хэши исходных файлов запоминаются по пути, размеру и времени изменения
+        self._hashes_path = os.path.join(cache_dir, "sources.json")
+        self._hashes = {}
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path, encoding='utf-8') as hashes_file:
+                self._hashes = json.load(hashes_file)
+        
+        self.total_bytes = sum(size for _, size, _ in self._iter_entries())
+    
+    def _iter_entries(self):
+        """Перебирает записи кэша: (время использования, размер, путь)"""
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield stat.st_mtime, stat.st_size, path
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+    
+    def source_hash(self, video_path):
+        """Возвращает SHA-256 содержимого исходного видео"""
+        stat = os.stat(video_path)
+        path = os.path.abspath(video_path)
+        memo_key = f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+        if memo_key not in self._hashes:
+            digest = hashlib.sha256()
+            with open(video_path, 'rb') as video_file:
+                for block in iter(lambda: video_file.read(1024 * 1024), b""):
+                    digest.update(block)
+            # Хэш прежней версии того же файла больше не понадобится
+            self._hashes = {key: value for key, value in self._hashes.items() if key.rsplit("|", 2)[0] != path}
+            self._hashes[memo_key] = digest.hexdigest()
+            self._save_hashes()
+        return self._hashes[memo_key]
+    
+    def _save_hashes(self):
+        with open(self._hashes_path, 'w', encoding='utf-8') as hashes_file:
+            json.dump(self._hashes, hashes_file)
+    
+    def prune_sources(self):
+        """Забывает хэши исходных файлов, которые удалены или изменились после хэширования"""
+        current = {}
+        for memo_key, digest in self._hashes.items():
+            path, size, mtime_ns = memo_key.rsplit("|", 2)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_size == int(size) and stat.st_mtime_ns == int(mtime_ns):
+                current[memo_key] = digest
+        
+        if len(current) != len(self._hashes):
+            self._hashes = current
+            self._save_hashes()
+    
+    def frame_key(self, source_hash, frame_number, width, height, charset, seed, incremental=False, dither="random", engine="brightness",
+                  feature_block=(6, 3), edge_weight=0.5):
+        """Ключ записи: все, от чего зависит результат frame_to_indices"""
+        # В пошаговом режиме кадр зависит от предыдущих, поэтому записи хранятся отдельно
+        mode = "incremental" if incremental else "full"
+        # Размер блока признаков и вес перепадов меняют выбор символов в режиме shape
+        block_height, block_width = feature_block
+        key = (f"{self.VERSION}|{source_hash}|{frame_number}|{width}x{height}|{charset}|{seed}|{mode}|{dither}|{engine}"
+               f"|{block_height}x{block_width}|{edge_weight}")
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    def contains(self, key):
+        """Проверяет наличие записи, не читая ее, и отмечает ее использованной"""
+        # Отметка защищает записи, которые еще будут прочитаны, от вытеснения новыми
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            return False
+        return True
+    
+    def get(self, key):
+        """Возвращает (char_indices, colors) или None, если записи нет"""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                indices = entry["char_indices"].astype(np.intp), entry["colors"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, EOFError):
+            # Испорченная запись (например, после сбоя диска) удаляется, кадр будет декодирован заново
+            self.remove(path)
+            return None
+        
+        # Время изменения файла служит временем последнего использования
+        os.utime(path)
+        return indices
+    
+    def remove(self, path):
+        """Удаляет запись кэша и вычитает ее размер из общего"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.total_bytes -= size
+    
+    def put(self, key, char_indices, colors):
+        """Сохраняет результат конвертации кадра и вытесняет старые записи при превышении размера"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Перезаписываемая запись уже учтена в общем размере
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        
+        # Временный файл без расширения .npz не попадает в перебор записей
+        char_dtype = np.uint8 if char_indices.max(initial=0) < 256 else np.uint16
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'wb') as entry_file:
+            np.savez_compressed(entry_file, char_indices=char_indices.astype(char_dtype), colors=colors)
+        os.replace(temporary_path, path)
+        
+        self.total_bytes += os.path.getsize(path) - old_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+    
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш не станет меньше 90% лимита"""
+        entries = sorted(self._iter_entries())
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            os.remove(path)
+            self.total_bytes -= size
+        self.prune_sources()
+
+def convert(inputs, width=120, height=60, fps=30, max_frames=300, output_width=1920, output_height=1080, workers=1, seed=None, output_dir=None, cache_dir=None, cache_size_mb=2048, incremental=False,
+            encoder="mp4v", preset="medium", crf=18, lossless=False, scale=1, dither="random", engine="brightness", metrics=None):
+    """Конвертирует видео в ASCII MP4 без GUI и возвращает список пар (видео, созданный файл)"""
+    converter = VideoToASCII()
+    converter.dither = dither
+    converter.engine = engine
+    # metrics - Metrics с callback для прогресса и ETA или None
+    if metrics is not None:
+        converter.metrics = metrics
+    cache = FrameCache(cache_dir, cache_size_mb * 1024 * 1024) if cache_dir else None
+    encoder_settings = {"encoder": encoder, "preset": preset, "crf": crf, "lossless": lossless, "scale": scale}
+    results = []
+    for video_path in Common.find_videos(inputs):
+        output_file, _ = converter.process_video(
+            video_path, max_frames, width, height, fps, output_width, output_height, workers, seed, output_dir, cache, incremental, encoder_settings)
+        results.append((video_path, output_file))
+    return results
+
+def run_gui(workers=1):
+    """Интерактивный режим: выбор файла в диалоге и сообщение о результате"""
+    import tkinter as tk
+    from tkinter import messagebox
+    
     converter = VideoToASCII()
     
     print("=== Видео в ASCII конвертер с сохранением в MP4 ===")
@@ -245,6 +887,7 @@ def main():
         print("- Разрешение видео: 1920x1080")
         print("- Цвета: Включены")
         print("- Случайные символы: Включены")
+        print(f"- Процессов: {workers}")
         
         # Обрабатываем видео
         video_file, output_dir = converter.process_video(
@@ -254,7 +897,8 @@ def main():
             height=60, 
             fps=30,
             output_width=1920,
-            output_height=1080
+            output_height=1080,
+            workers=workers
         )
         
         print(f"\nКонвертация завершена!")
@@ -284,5 +928,81 @@ def main():
         print(f"Ошибка при обработке видео: {e}")
         messagebox.showerror("Ошибка", f"Не удалось обработать видео:\n{e}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Конвертер видео в ASCII видео MP4")
+    parser.add_argument("inputs", nargs="*", help="видео файлы, папки или маски вида *.mp4")
+    parser.add_argument("--width", type=int, default=120, help="ширина ASCII сетки в символах")
+    parser.add_argument("--height", type=int, default=60, help="высота ASCII сетки в символах")
+    parser.add_argument("--fps", type=float, default=30, help="частота кадров выходного видео")
+    parser.add_argument("--max-frames", type=int, default=300, help="максимум кадров из одного видео")
+    parser.add_argument("--output-width", type=int, default=1920, help="ширина выходного видео в пикселях")
+    parser.add_argument("--output-height", type=int, default=1080, help="высота выходного видео в пикселях")
+    parser.add_argument("--native", action="store_true", help="размер кадра равен сетке символов (без черных полей)")
+    parser.add_argument("--scale", type=int, default=1, help="целочисленное увеличение кадра при кодировании")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов конвертации и отрисовки")
+    parser.add_argument("--seed", type=int, help="seed случайных символов для повторяемого результата")
+    parser.add_argument("--dither", choices=["random", "ordered", "blue"], default="random",
+                        help="узор разброса символов: случайный, матрица Байера или синий шум")
+    parser.add_argument("--engine", choices=["brightness", "shape"], default="brightness",
+                        help="выбор символа по средней яркости ячейки или по форме блока пикселей")
+    parser.add_argument("--output-dir", help="папка для результатов (по умолчанию рядом с видео)")
+    parser.add_argument("--cache-dir", help="папка кэша конвертированных кадров для повторной отрисовки")
+    parser.add_argument("--cache-size-mb", type=int, default=2048, help="максимальный размер кэша в мегабайтах")
+    parser.add_argument("--incremental", action="store_true", help="перерисовывать только изменившиеся ячейки (в одном процессе)")
+    parser.add_argument("--encoder", choices=["mp4v", "libx264", "libx265"], default="mp4v",
+                        help="кодировщик: mp4v (OpenCV) или libx264/libx265 через ffmpeg")
+    parser.add_argument("--preset", default="medium", help="пресет скорости ffmpeg (ultrafast ... veryslow)")
+    parser.add_argument("--crf", type=int, default=18, help="качество ffmpeg: меньше - лучше и больше файл")
+    parser.add_argument("--lossless", action="store_true", help="кодировать без потерь (только ffmpeg)")
+    parser.add_argument("--metrics", metavar="FILE", help="писать метрики этапов и прогресс в файл JSON lines")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="период записи метрик в секундах")
+    parser.add_argument("--calibrate", action="store_true", help="отсортировать символы по плотности глифов и сохранить калибровку")
+    parser.add_argument("--gui", action="store_true", help="выбрать файл в диалоге (режим по умолчанию без входных файлов)")
+    args = parser.parse_args(argv)
+    
+    if args.calibrate:
+        # Калибровка сохраняется в файл и подхватывается всеми следующими конвертерами
+        entry = VideoToASCII().calibrate_charset()
+        print(f"Калибровка сохранена: {Common.CALIBRATION_FILE}")
+        print(f"Символы по возрастанию плотности: {entry['charset']}")
+        if not args.inputs:
+            return 0
+    
+    if args.scale < 1:
+        parser.error("--scale должен быть не меньше 1")
+    if args.native:
+        args.output_width = args.output_height = None
+    
+    if args.gui or not args.inputs:
+        run_gui(args.workers)
+        return 0
+    
+    videos = Common.find_videos(args.inputs)
+    if not videos:
+        print("Не найдено ни одного видео файла", file=sys.stderr)
+        return 1
+    
+    # Ошибка в одном файле не останавливает обработку остальных
+    converter = VideoToASCII()
+    converter.dither = args.dither
+    converter.engine = args.engine
+    if args.metrics:
+        converter.metrics = Metrics(args.metrics, args.metrics_interval)
+    cache = FrameCache(args.cache_dir, args.cache_size_mb * 1024 * 1024) if args.cache_dir else None
+    encoder_settings = {"encoder": args.encoder, "preset": args.preset, "crf": args.crf, "lossless": args.lossless, "scale": args.scale}
+    failed = 0
+    for video_path in videos:
+        try:
+            output_file, _ = converter.process_video(
+                video_path, args.max_frames, args.width, args.height, args.fps,
+                args.output_width, args.output_height, args.workers, args.seed, args.output_dir, cache, args.incremental, encoder_settings)
+            print(f"Готово: {video_path} -> {output_file}")
+        except Exception as e:
+            failed += 1
+            print(f"Ошибка при обработке {video_path}: {e}", file=sys.stderr)
+    
+    print(f"Обработано видео: {len(videos) - failed}/{len(videos)}")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+import Common
+
+@pytest.fixture(scope="session")
+def to_bat():
+    return Common.load_script(os.path.join(SCRIPT_DIR, "To BAT.py"), "to_bat")
+
+@pytest.fixture(scope="session")
+def to_mp4():
+    return Common.load_script(os.path.join(SCRIPT_DIR, "To MP4.py"), "to_mp4")
+
+@pytest.fixture(scope="session")
+def to_all():
+    return Common.load_script(os.path.join(SCRIPT_DIR, "To All.py"), "to_all")
+
+@pytest.fixture(scope="session")
+def video_path(tmp_path_factory):
+    """Короткое тестовое видео: градиент и движущийся круг"""
+    path = str(tmp_path_factory.mktemp("video") / "clip.mp4")
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (160, 120))
+    gradient = np.zeros((120, 160, 3), dtype=np.uint8)
+    gradient[:] = np.linspace(0, 255, 160, dtype=np.float32)[None, :, None]
+    for i in range(12):
+        frame = gradient.copy()
+        cv2.circle(frame, (10 + i * 10, 60), 25, (40, 180, 230), -1)
+        out.write(frame)
+    out.release()
+    return path
@@ -0,0 +1,29 @@
+import os
+import re
+
+def test_chunked_bat_file(to_bat, tmp_path):
+    converter = to_bat.VideoToASCII()
+    chunk_dir = tmp_path / "clip_chunks"
+    chunk_dir.mkdir()
+    # Части прошлого, более длинного запуска
+    (chunk_dir / "chunk_0009.bat").write_text("echo old\n", encoding="utf-8")
+    
+    frames = [[f"frame {i} line {row}" for row in range(2)] for i in range(7)]
+    # Видео закончилось раньше: обещано 10 кадров, записано 7
+    bat_filename, _ = converter.create_bat_file(str(tmp_path / "clip.mp4"), iter(frames), fps=10, frame_count=10,
+                                                output_dir=str(tmp_path), chunk_frames=3)
+    
+    assert sorted(os.listdir(chunk_dir)) == ["chunk_0000.bat", "chunk_0001.bat", "chunk_0002.bat"]
+    with open(bat_filename, encoding="utf-8") as bat_file:
+        main = bat_file.read()
+    calls = re.findall(r'^call "%~dp0clip_chunks\\(chunk_\d+\.bat)"$', main, re.M)
+    assert calls == ["chunk_0000.bat", "chunk_0001.bat", "chunk_0002.bat"]
+    assert "echo frame" not in main
+    assert "set FRAME_COUNT=7\n" in main
+    
+    for number, chunk_name in enumerate(calls):
+        with open(chunk_dir / chunk_name, encoding="utf-8") as chunk_file:
+            chunk = chunk_file.read()
+        shown = [int(n) for n in re.findall(r"^echo Frame (\d+)/%FRAME_COUNT%: clip$", chunk, re.M)]
+        assert shown == list(range(number * 3 + 1, min(number * 3 + 3, 7) + 1))
+        assert f"echo frame {shown[-1] - 1} line 1\n" in chunk
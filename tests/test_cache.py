@@ -0,0 +1,88 @@
+import os
+
+import cv2
+import numpy as np
+
+def test_cached_frames_are_read_lazily(to_mp4, video_path, tmp_path):
+    converter = to_mp4.VideoToASCII()
+    cache = to_mp4.FrameCache(str(tmp_path / "cache"))
+    frame_numbers = list(range(6))
+    keys = {n: cache.frame_key("source", n, 20, 10, converter.ascii_chars, 0) for n in frame_numbers}
+    for n in (0, 1, 2, 4, 5):
+        cache.put(keys[n], np.full((10, 20), n), np.zeros((10, 20, 3), dtype=np.uint8))
+    
+    reads = []
+    get = cache.get
+    cache.get = lambda key: reads.append(key) or get(key)
+    
+    frames = converter.iter_cached_frames(cv2.VideoCapture(video_path), frame_numbers, cache, keys, video_path)
+    frame_number, frame, indices = next(frames)
+    # Первый кадр отдается до чтения остальных записей
+    assert (frame_number, frame, reads) == (0, None, [keys[0]])
+    
+    rest = list(frames)
+    assert [item[0] for item in rest] == [1, 2, 3, 4, 5]
+    assert rest[2][1] is not None and rest[2][2] is None
+    assert int(rest[3][2][0][0, 0]) == 4
+
+def test_overwrite_and_temporary_files_do_not_grow_cache(to_mp4, tmp_path):
+    cache = to_mp4.FrameCache(str(tmp_path / "cache"))
+    char_indices = np.arange(200).reshape(10, 20)
+    colors = np.zeros((10, 20, 3), dtype=np.uint8)
+    cache.put("ab" * 32, char_indices, colors)
+    size = cache.total_bytes
+    cache.put("ab" * 32, char_indices, colors)
+    assert cache.total_bytes == size
+    
+    # Временный файл, оставшийся после сбоя, не считается записью
+    open(cache._path("ab" * 32) + ".tmp", 'wb').close()
+    assert to_mp4.FrameCache(cache.cache_dir).total_bytes == size
+
+def test_eviction_forgets_deleted_sources(to_mp4, tmp_path):
+    cache = to_mp4.FrameCache(str(tmp_path / "cache"))
+    source = tmp_path / "clip.mp4"
+    source.write_bytes(b"first")
+    cache.source_hash(str(source))
+    os.utime(source, ns=(1, 1))
+    cache.source_hash(str(source))
+    # Хэш прежней версии файла заменяется, а не копится
+    assert len(cache._hashes) == 1
+    
+    source.unlink()
+    cache.evict()
+    assert cache._hashes == {}
+    assert to_mp4.FrameCache(cache.cache_dir)._hashes == {}
+
+def test_frame_key_depends_on_shape_settings(to_mp4, tmp_path):
+    cache = to_mp4.FrameCache(str(tmp_path / "cache"))
+    keys = {
+        cache.frame_key("source", 0, 20, 10, " .:", 0, engine="shape", feature_block=block, edge_weight=weight)
+        for block in ((6, 3), (4, 2)) for weight in (0.5, 1.0)
+    }
+    assert len(keys) == 4
+
+def test_corrupt_entry_is_removed_and_decoded_again(to_mp4, video_path, tmp_path):
+    converter = to_mp4.VideoToASCII()
+    cache = to_mp4.FrameCache(str(tmp_path / "cache"))
+    frame_numbers = list(range(4))
+    keys = {n: cache.frame_key("source", n, 20, 10, converter.ascii_chars, 0) for n in frame_numbers}
+    for n in frame_numbers:
+        cache.put(keys[n], np.full((10, 20), n), np.zeros((10, 20, 3), dtype=np.uint8))
+    
+    # Запись обрезана, как после сбоя записи на диск
+    path = cache._path(keys[2])
+    with open(path, 'rb') as entry_file:
+        data = entry_file.read()
+    with open(path, 'wb') as entry_file:
+        entry_file.write(data[:len(data) // 2])
+    size = cache.total_bytes
+    
+    frames = list(converter.iter_cached_frames(cv2.VideoCapture(video_path), frame_numbers, cache, keys, video_path))
+    assert [item[0] for item in frames] == frame_numbers
+    assert frames[2][1] is not None and frames[2][2] is None
+    assert int(frames[3][2][0][0, 0]) == 3
+    
+    # Испорченная запись удалена и больше не учитывается в размере кэша
+    assert not os.path.exists(path)
+    assert cache.total_bytes == size - len(data) // 2
+    assert cache.get(keys[2]) is None
@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+@pytest.mark.parametrize("script", ["to_bat", "to_mp4"])
+def test_recalibration_replaces_entry(script, request, tmp_path):
+    module = request.getfixturevalue(script)
+    path = str(tmp_path / "calibration.json")
+    converter = module.VideoToASCII()
+    base_chars = converter.base_chars
+    
+    first = converter.calibrate_charset(path)
+    # Повторная калибровка уже отсортированного набора пишет ту же запись
+    second = converter.calibrate_charset(path)
+    with open(path, encoding='utf-8') as calibration_file:
+        calibrations = json.load(calibration_file)
+    assert list(calibrations) == [converter.calibration_key()]
+    assert first == second
+    assert sorted(first["charset"]) == sorted(base_chars)
+    
+    loaded = module.VideoToASCII()
+    assert loaded.load_calibration(path)
+    assert loaded.ascii_chars == first["charset"]
+    assert loaded.calibration_key() == converter.calibration_key()
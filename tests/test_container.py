@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+def test_container_round_trip(to_bat, tmp_path):
+    converter = to_bat.VideoToASCII()
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(7):
+        char_indices = rng.integers(0, len(converter.ascii_chars), size=(6, 10))
+        color_indices = rng.integers(0, len(converter.colors), size=(6, 10))
+        # Часть ячеек не меняется между кадрами, как в настоящем видео
+        if frames:
+            char_indices[:3] = frames[-1][0][:3]
+        frames.append((char_indices, color_indices))
+    
+    path, _ = converter.create_ascii_container(str(tmp_path / "clip.mp4"), frames, fps=12, width=10, height=6,
+                                               keyframe_interval=3, output_dir=str(tmp_path))
+    
+    with to_bat.ASCIIContainer(path) as container:
+        assert len(container) == len(frames)
+        assert (container.width, container.height, container.fps) == (10, 6, 12)
+        # Последовательное чтение и произвольный доступ дают те же кадры
+        for (char_indices, color_indices), (read_chars, read_colors) in zip(frames, container):
+            assert np.array_equal(read_chars, char_indices)
+            assert np.array_equal(read_colors, color_indices)
+        for number in (5, 1, 6, 3):
+            assert np.array_equal(container.read_indices(number)[0], frames[number][0])
+        assert container.read_ascii(2, use_colors=False) == converter.indices_to_ascii(frames[2][0])
+
+def test_container_closes_file_on_bad_header(to_bat, tmp_path, monkeypatch):
+    path = tmp_path / "broken.ascv"
+    path.write_bytes(b"NOPE" + bytes(32))
+    opened = []
+    
+    def tracking_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+    
+    monkeypatch.setattr(to_bat, "open", tracking_open, raising=False)
+    with pytest.raises(ValueError):
+        to_bat.ASCIIContainer(str(path))
+    assert opened and opened[0].closed
@@ -0,0 +1,60 @@
+import hashlib
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import SCRIPT_DIR
+
+# Пороги узора в новом интерпретаторе: кэш и состояние генераторов не переносятся между запусками
+THRESHOLDS_SCRIPT = """
+import hashlib, os, sys
+sys.path.insert(0, sys.argv[1])
+import Common
+converter = Common.load_script(os.path.join(sys.argv[1], "To BAT.py"), "to_bat").VideoToASCII()
+print(hashlib.sha256(converter.get_dither_thresholds(sys.argv[2], 37, 70).tobytes()).hexdigest())
+"""
+
+def uncalibrated(module):
+    """Конвертер с исходным набором символов, даже если рядом сохранена калибровка"""
+    converter = module.VideoToASCII()
+    converter.ascii_chars = converter.base_chars
+    return converter
+
+def random_frame(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+
+def test_bat_without_randomness_matches_per_pixel_reference(to_bat):
+    converter = uncalibrated(to_bat)
+    frame = random_frame()
+    gray = cv2.cvtColor(cv2.resize(frame, (40, 20)), cv2.COLOR_BGR2GRAY)
+    expected = ["".join(converter.pixel_to_ascii(value, use_random=False) for value in row) for row in gray]
+    
+    char_indices, _ = converter.frame_to_indices(frame, 40, 20, use_random=False)
+    assert converter.indices_to_ascii(char_indices, None) == expected
+    assert converter.frame_to_ascii(frame, 40, 20, use_colors=False, use_random=False) == expected
+
+def test_mp4_without_randomness_matches_per_pixel_reference(to_mp4):
+    converter = uncalibrated(to_mp4)
+    frame = random_frame(1)
+    resized = cv2.resize(frame, (40, 20))
+    gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+    expected_chars = ["".join(converter.pixel_to_ascii(value, use_random=False) for value in row) for row in gray]
+    expected_colors = [[tuple(int(channel) for channel in converter.get_color_from_pixel(pixel)) for pixel in row]
+                       for row in resized]
+    
+    ascii_frame, colors_frame = converter.frame_to_ascii(frame, 40, 20, use_colors=True, use_random=False)
+    assert ascii_frame == expected_chars
+    assert colors_frame == expected_colors
+
+@pytest.mark.parametrize("pattern", ["ordered", "blue"])
+def test_dither_thresholds_are_reproducible(to_bat, to_mp4, pattern):
+    thresholds = to_bat.VideoToASCII().get_dither_thresholds(pattern, 37, 70)
+    assert np.array_equal(to_mp4.VideoToASCII().get_dither_thresholds(pattern, 37, 70), thresholds)
+    assert thresholds.min() > 0 and thresholds.max() < 1
+    
+    result = subprocess.run([sys.executable, "-c", THRESHOLDS_SCRIPT, SCRIPT_DIR, pattern], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == hashlib.sha256(thresholds.tobytes()).hexdigest()
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+def read_frames(path):
+    """Декодирует все кадры видео"""
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def test_incremental_matches_full_conversion(to_mp4, video_path):
+    converter = to_mp4.VideoToASCII()
+    converter.dither = "ordered"
+    width, height = 24, 12
+    output_size = converter.get_grid_size(width, height)
+    # Без допуска по цвету пошаговая отрисовка должна совпадать с полной
+    renderer = to_mp4.IncrementalRenderer(converter, width, height, *output_size, color_tolerance=0)
+    
+    for frame_number, frame in enumerate(read_frames(video_path)):
+        char_indices, colors, image = renderer.convert_frame(frame_number, frame, 1)
+        full_chars, full_colors, full_image = converter.convert_frame(frame_number, frame, width, height, 1, *output_size)
+        assert np.array_equal(char_indices, full_chars)
+        assert np.array_equal(colors, full_colors)
+        assert np.array_equal(image, full_image)
+
+def test_static_input_reuses_cells(to_mp4, video_path):
+    converter = to_mp4.VideoToASCII()
+    converter.dither = "ordered"
+    width, height = 24, 12
+    renderer = to_mp4.IncrementalRenderer(converter, width, height, *converter.get_grid_size(width, height))
+    frame = read_frames(video_path)[0]
+    
+    for frame_number in range(10):
+        renderer.convert_frame(frame_number, frame, 1)
+    # Пересчитывается только первый кадр
+    assert renderer.reused_fraction == 0.9
@@ -0,0 +1,47 @@
+import socket
+import threading
+
+import numpy as np
+
+class BlockingCapture:
+    """Источник, который отдает один кадр, а затем зависает на чтении, как отключенная камера"""
+    
+    def __init__(self):
+        self.read_count = 0
+        self.released = threading.Event()
+    
+    def read(self):
+        self.read_count += 1
+        if self.read_count > 1:
+            self.released.wait()
+            return False, None
+        return True, np.full((24, 32, 3), 128, dtype=np.uint8)
+    
+    def release(self):
+        self.released.set()
+    
+    def get(self, prop):
+        return 0
+
+def test_stream_live_closes_socket_and_does_not_hang(to_bat, monkeypatch):
+    monkeypatch.setattr(to_bat, "open_source", lambda source: BlockingCapture())
+    monkeypatch.setattr(to_bat, "GRABBER_JOIN_TIMEOUT", 0.2)
+    
+    server = socket.create_server(("127.0.0.1", 0))
+    received = []
+    
+    def accept():
+        connection, _ = server.accept()
+        with connection:
+            # Чтение заканчивается, только когда клиент закрыл сокет
+            received.append(connection.makefile('rb').read())
+    
+    thread = threading.Thread(target=accept)
+    thread.start()
+    stats = to_bat.stream_live("camera", 8, 4, max_frames=1, output=f"tcp:127.0.0.1:{server.getsockname()[1]}")
+    thread.join(5)
+    server.close()
+    
+    assert stats["shown_frames"] == 1
+    assert not thread.is_alive()
+    assert received and received[0].endswith(b"\033[?25h")
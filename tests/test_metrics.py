@@ -0,0 +1,25 @@
+import cv2
+import pytest
+
+import Common
+
+def test_scripts_share_metrics(to_bat, to_mp4):
+    assert to_bat.Metrics is to_mp4.Metrics
+    assert to_bat.NullMetrics is to_mp4.NullMetrics
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_mp4_counts_converted_frames(to_mp4, video_path, tmp_path, incremental):
+    metrics = to_mp4.Metrics()
+    to_mp4.convert([video_path], width=20, height=10, max_frames=5, output_width=None, output_height=None,
+                   output_dir=str(tmp_path), incremental=incremental, metrics=metrics)
+    assert metrics.counters["frames_converted"] == metrics.counters["frames_written"] == 5
+
+@pytest.mark.parametrize("min_seek_gap", [1, 100])
+def test_skipped_frames_are_counted_for_seek_and_grab(video_path, min_seek_gap):
+    metrics = Common.Metrics()
+    frames = list(Common.iter_video_frames(cv2.VideoCapture(video_path), [0, 5, 10], metrics, min_seek_gap, show_progress=False))
+    assert [frame_number for frame_number, _ in frames] == [0, 5, 10]
+    assert metrics.counters["frames_decoded"] == 3
+    assert metrics.counters["frames_skipped"] == 8
+    # С малым порогом первый пропуск всегда делается перемоткой
+    assert ("seek" in metrics.stages) == (min_seek_gap == 1)
@@ -0,0 +1,103 @@
+import io
+import re
+
+import numpy as np
+import pytest
+
+ESCAPE = re.compile(r"\033\[([?0-9;]*)([A-Za-z])|(.)", re.S)
+
+class Screen:
+    """Модель терминала: позиция курсора, текущий цвет и содержимое ячеек"""
+    
+    def __init__(self, converter, height, width):
+        self.color_codes = {code: i for i, code in enumerate(converter.colors)}
+        self.chars = np.full((height, width), " ", dtype=object)
+        self.colors = np.full((height, width), -1)
+        self.y = self.x = 0
+        self.color = -1
+    
+    def feed(self, output):
+        for match in ESCAPE.finditer(output):
+            params, command, char = match.groups()
+            if char is not None:
+                self.chars[self.y, self.x] = char
+                self.colors[self.y, self.x] = self.color
+                self.x += 1
+            elif command == "H":
+                y, x = params.split(";")
+                self.y, self.x = int(y) - 1, int(x) - 1
+            elif command == "J":
+                self.chars[:] = " "
+                self.colors[:] = -1
+            elif command == "m":
+                self.color = self.color_codes.get(f"\033[{params}m", -1)
+
+def make_frames(converter, count, shape=(8, 30)):
+    """Кадры с редкими, частыми и полными изменениями относительно предыдущего"""
+    rng = np.random.default_rng(3)
+    char_indices = rng.integers(0, len(converter.ascii_chars), size=shape)
+    color_indices = rng.integers(0, len(converter.colors), size=shape)
+    frames = [(char_indices, color_indices)]
+    for i in range(1, count):
+        char_indices, color_indices = frames[-1][0].copy(), frames[-1][1].copy()
+        changed = rng.random(shape) < (0.05, 0.4, 1.0)[i % 3]
+        char_indices[changed] = rng.integers(0, len(converter.ascii_chars), size=changed.sum())
+        color_indices[changed] = rng.integers(0, len(converter.colors), size=changed.sum())
+        frames.append((char_indices, color_indices))
+    return frames
+
+def test_render_diff_reproduces_frames(to_bat):
+    converter = to_bat.VideoToASCII()
+    player = to_bat.TerminalPlayer(converter, out=io.StringIO())
+    frames = make_frames(converter, 9)
+    screen = Screen(converter, *frames[0][0].shape)
+    chars = np.array(list(converter.ascii_chars), dtype=object)
+    
+    for char_indices, color_indices in frames:
+        screen.feed(player.render_diff(char_indices, color_indices))
+        assert np.array_equal(screen.chars, chars[char_indices])
+        assert np.array_equal(screen.colors, color_indices)
+    
+    # Повтор того же кадра ничего не выводит
+    assert player.render_diff(*frames[-1]) == ""
+
+class FakeClock:
+    """Часы, которые идут только при sleep() и при подготовке кадров"""
+    
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+    
+    def __call__(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def test_play_drops_late_frames_and_reports_fps(to_bat):
+    converter = to_bat.VideoToASCII()
+    clock = FakeClock()
+    out = io.StringIO()
+    player = to_bat.TerminalPlayer(converter, out=out, fps=10, clock=clock, sleep=clock.sleep)
+    frames = make_frames(converter, 8)
+    # Подготовка кадра 2 и последнего кадра занимает дольше нескольких кадров
+    costs = {2: 0.35, 7: 0.5}
+    
+    def slow_frames():
+        for i, frame in enumerate(frames):
+            clock.now += costs.get(i, 0.0)
+            yield frame
+    
+    stats = player.play(slow_frames(), frame_count=len(frames))
+    
+    # Кадры 2 и 3 опоздали больше чем на кадр; последний показывается, даже опоздав
+    assert stats["dropped_frames"] == 2
+    assert stats["shown_frames"] == 6
+    assert stats["fps"] == pytest.approx(6 / 1.1)
+    assert sum(clock.sleeps) == pytest.approx(0.1 + 0.05 + 0.1)
+    
+    # Экран после воспроизведения показывает последний кадр
+    screen = Screen(converter, *frames[0][0].shape)
+    screen.feed(out.getvalue())
+    assert np.array_equal(screen.colors, frames[-1][1])
@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import SCRIPT_DIR
+
+# Скрипт загружается по пути, как в README, а пул запускается через spawn (как в Windows и macOS)
+SPAWN_SCRIPT = """
+import multiprocessing, os, sys
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    script_path, module_name, video_path, output_dir = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(script_path))
+    import Common
+    module = Common.load_script(script_path, module_name)
+    for workers in (1, 2):
+        module.convert([video_path], max_frames=6, width=24, height=12, workers=workers, seed=1,
+                       output_dir=os.path.join(output_dir, str(workers)), **{options})
+"""
+
+def run_spawned(filename, module_name, video_path, tmp_path, options):
+    """Запускает convert() с пулом из двух процессов в отдельном интерпретаторе вне папки скриптов"""
+    script = tmp_path / "run.py"
+    script.write_text(SPAWN_SCRIPT.replace("{options}", options), encoding="utf-8")
+    result = subprocess.run([sys.executable, str(script), f"{SCRIPT_DIR}/{filename}", module_name, video_path, str(tmp_path)],
+                            cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def read_frames(path):
+    """Декодирует все кадры видео"""
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return np.array(frames)
+
+def test_bat_pool_with_spawn(video_path, tmp_path):
+    run_spawned("To BAT.py", "to_bat", video_path, tmp_path, "{'chunk_frames': 0}")
+    single = (tmp_path / "1" / "clip_ascii.bat").read_bytes()
+    assert (tmp_path / "2" / "clip_ascii.bat").read_bytes() == single
+
+@pytest.mark.parametrize("dither", ["ordered", "blue"])
+def test_dither_patterns_match_across_workers(video_path, tmp_path, dither):
+    run_spawned("To BAT.py", "to_bat", video_path, tmp_path, f"{{'chunk_frames': 0, 'dither': '{dither}'}}")
+    single = (tmp_path / "1" / "clip_ascii.bat").read_bytes()
+    assert (tmp_path / "2" / "clip_ascii.bat").read_bytes() == single
+
+def test_mp4_pool_with_spawn(video_path, tmp_path):
+    run_spawned("To MP4.py", "to_mp4", video_path, tmp_path, "{'output_width': 320, 'output_height': 240}")
+    single = read_frames(tmp_path / "1" / "clip_ascii.mp4")
+    pooled = read_frames(tmp_path / "2" / "clip_ascii.mp4")
+    assert len(single) == 6
+    assert np.array_equal(pooled, single)
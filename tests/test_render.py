@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+def test_grid_larger_than_frame_is_rejected(to_mp4):
+    converter = to_mp4.VideoToASCII()
+    char_indices = np.zeros((12, 24), dtype=np.intp)
+    colors = np.zeros((12, 24, 3), dtype=np.uint8)
+    grid_width, grid_height = converter.get_grid_size(24, 12)
+    
+    # Сетка точно по размеру кадра помещается целиком
+    image = converter.render_frame(char_indices, colors, grid_width, grid_height)
+    assert image.shape == (grid_height, grid_width, 3)
+    
+    # На пиксель меньше по любой стороне - ошибка, а не обрезанный кадр
+    with pytest.raises(ValueError):
+        converter.render_frame(char_indices, colors, grid_width - 1, grid_height)
+    with pytest.raises(ValueError):
+        converter.render_frame(char_indices, colors, grid_width, grid_height - 1)
+    with pytest.raises(ValueError):
+        converter.process_video("missing.mp4", width=24, height=12, output_width=grid_width, output_height=grid_height - 1)
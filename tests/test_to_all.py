@@ -0,0 +1,88 @@
+import base64
+import json
+import re
+import struct
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import Common
+
+def decode_html(path):
+    """Восстанавливает ячейки всех кадров HTML страницы так же, как ее JS плеер"""
+    with open(path, encoding='utf-8') as html_file:
+        page = html_file.read()
+    meta = json.loads(re.search(r'const meta = (.*);\n', page).group(1))
+    data = base64.b64decode(re.search(r'atob\("([^"]*)"\)', page).group(1))
+    cell_count = meta["width"] * meta["height"]
+    
+    cells = np.zeros((cell_count, 3), dtype=np.uint8)
+    frames = []
+    for number in range(len(meta["offsets"]) - 1):
+        position = meta["offsets"][number]
+        if number in meta["keyframes"]:
+            cells = np.frombuffer(data, np.uint8, cell_count * 3, position).reshape(-1, 3).copy()
+        else:
+            runs, = struct.unpack_from("<I", data, position)
+            position += 4
+            cell = 0
+            for _ in range(runs):
+                skip, length = struct.unpack_from("<II", data, position)
+                position += 8
+                cell += skip
+                cells[cell:cell + length] = np.frombuffer(data, np.uint8, length * 3, position).reshape(-1, 3)
+                position += length * 3
+                cell += length
+        frames.append(cells.copy())
+    return meta, frames
+
+def direct_frames(to_mp4, video_path, width, height, max_frames, seed, dither):
+    """Кадры той же конвертации без получателей"""
+    converter = to_mp4.VideoToASCII()
+    converter.dither = dither
+    cap = cv2.VideoCapture(video_path)
+    frame_numbers = Common.get_sample_frames(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), max_frames)
+    frames = []
+    for frame_number, frame in Common.iter_video_frames(cap, frame_numbers, converter.metrics, converter.min_seek_gap, converter.show_progress):
+        rng = np.random.default_rng([seed, frame_number])
+        frames.append(converter.frame_to_indices(frame, width, height, use_colors=True, use_random=True, rng=rng))
+    return converter, frames
+
+def test_html_and_gif_match_direct_conversion(to_all, to_mp4, to_bat, video_path, tmp_path):
+    results = to_all.convert_all(video_path, ["html", "gif"], width=16, height=8, max_frames=10, seed=5,
+                                 output_dir=str(tmp_path), dither="ordered", mp4=to_mp4, bat=to_bat)
+    converter, expected = direct_frames(to_mp4, video_path, 16, 8, 10, 5, "ordered")
+    
+    meta, frames = decode_html(results["html"])
+    assert (meta["width"], meta["height"], len(frames)) == (16, 8, len(expected))
+    for cells, (char_indices, colors) in zip(frames, expected):
+        assert np.array_equal(cells, to_all.HTMLSink.pack_cells(char_indices, colors))
+    
+    sink = to_all.AnimatedImageSink(converter, video_path, 30, str(tmp_path), "gif", 0.5)
+    with Image.open(results["gif"]) as gif:
+        assert gif.n_frames == len(expected)
+        assert gif.info["loop"] == 0
+        for number, image in enumerate(sink.iter_images(iter(expected))):
+            gif.seek(number)
+            assert np.array_equal(np.asarray(gif.convert("RGB")), np.asarray(image.convert("RGB")))
+
+def test_sink_that_stops_early_does_not_block_producer(to_all):
+    class FirstFrameSink(to_all.Sink):
+        def consume(self, frames):
+            next(frames)
+    
+    sink = FirstFrameSink("first", "unused", max_queue=1)
+    sink.start()
+    
+    def produce():
+        for _ in range(20):
+            sink.put("frame")
+        sink.close()
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert sink.error is None